@@ -1,27 +1,42 @@
-from flask import Flask, render_template, request
+from flask import Flask, Response, make_response, render_template, request
 from wtforms import SelectField, SubmitField, BooleanField, TextField
 from flask_wtf import FlaskForm
-import spotipy
 import dotenv
-import psycopg2
+import hashlib
+import json
 import os
 import random
-import wikipedia
+import sys
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
-from spotify import SpotifyConnector, SongCleaner, ArtistCleaner
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # modules shared with the batch tools
+
+from spotify import SpotifyConnector, SpotifyTokenManager, DeviceRegistry
+from song_pool import SongPool
+from prefetch import SongPrefetcher
+from wiki import WikiLookup
+from play_counts import PlayCounts
+from question_queue import QuestionQueue
+import metrics
+import songbase
+from caching import DAY, NOT_CACHED, LRUCache, track_cache
+from cleaning import clean_artist
+from track_resolver import SpotifyClient, TrackResolver
 from scraping.lastfm import LastFMHelper
 
 dotenv.load_dotenv('flaskenv.env', verbose=True)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'JJASpotifyAppKey'
+app.config['SPOTIFY_TABLE_TTL'] = int(os.environ.get('SPOTIFY_TABLE_TTL', 6 * 60 * 60))  # seconds
+app.config['SPOTIFY_TABLE_CACHE_SIZE'] = int(os.environ.get('SPOTIFY_TABLE_CACHE_SIZE', 256))
 
 
 class SongLimiterForm(FlaskForm):
     intros = BooleanField("Intros")
     display_info_by_default = BooleanField("Display Info By Default")
+    deck = BooleanField("No Repeats")
     start_year = SelectField("Start Year")
     end_year = SelectField("End Year")
     min_position = SelectField("Min Position")
@@ -33,35 +48,25 @@ class ArtistPickerForm(FlaskForm):
     artist = TextField("Artist")
     country = SelectField("Country")
     search = SubmitField("Search")
+    play = SubmitField("Play top track")
 
 
 class SpotifyHelper():
-    def __init__(self):
-        self.spotify_conn = SpotifyConnector(scopes='user-library-read streaming user-read-playback-state')
-        self.token = self.spotify_conn.get_token()
-        self.sp_client = spotipy.Spotify(auth=self.token)
-
-    @staticmethod
-    def fetch_song_artist(max_pos, min_pos, year_start, year_end):
-        conn = psycopg2.connect(dbname=os.environ['DB_NAME'],
-                                user=os.environ['DB_USER'],
-                                host=os.environ['DB_HOST'],
-                                port=os.environ['DB_PORT'])
-
-        cur = conn.cursor()
-        cur.execute("""
-        SELECT 
-            song, artist, chart_peak, EXTRACT(YEAR FROM week_start_date)::INT, 
-            spotify_track_uri, spotify_song, spotify_artist, spotify_track_duration
-        FROM songbase.song_peaks_mv
-        WHERE chart_peak BETWEEN %s AND %s
-          AND EXTRACT(YEAR FROM week_start_date) BETWEEN %s AND %s
-          ORDER BY RANDOM() LIMIT 1
-          ;""",
-                    (max_pos, min_pos, year_start, year_end))
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
+    def __init__(self, sp_client, song_pool=None):
+        self.sp_client = sp_client
+        self.resolver = TrackResolver(self.sp_client, cache=track_cache())
+        self.song_pool = song_pool
+        self.top_tracks_cache = LRUCache(maxsize=512, ttl=DAY)
+
+    def fetch_song_artist(self, max_pos, min_pos, year_start, year_end, deck=False):
+        if self.song_pool and self.song_pool.index is not None:
+            filters = [int(i) for i in (max_pos, min_pos, year_start, year_end)]
+            song = self.song_pool.deal(*filters) if deck else self.song_pool.random_song(*filters)
+            if song is None:
+                raise LookupError('No songs peaked between {0} and {1} from {2} to {3}'.format(*filters))
+            return song
+
+        result = songbase.fetch_random_song(max_pos, min_pos, year_start, year_end)
         db_info = dict(song=result[0],
                        artist=result[1],
                        chart_peak=result[2],
@@ -82,31 +87,42 @@ class SpotifyHelper():
                                 min_pos,
                                 year_start,
                                 year_end,
-                                intro=True):
+                                intro=True,
+                                deck=False,
+                                on_pick=None):
+        """
+        on_pick, if given, is called with each song's db_info as soon as it's picked, before it's looked up on Spotify.
+        """
         while True:
             db_info, spotify_info = self.fetch_song_artist(max_pos,
                                                   min_pos,
                                                   year_start,
-                                                  year_end)
-            cleaned_song = SongCleaner(db_info['song']).clean_song()
-            cleaned_artist = ArtistCleaner(db_info['artist']).clean_artist()
-            results = self.sp_client.search(q='artist:' + cleaned_artist + ' AND track:' + cleaned_song,
-                                            limit=1,
-                                            type='track')
-            if results['tracks']['items'] and results['tracks']['items'][0]['id']:
-                track_duration = results['tracks']['items'][0]['duration_ms']
-                start_ms = self.get_random_start_point(track_duration=track_duration) if not intro else 0
-                spotify_info = dict(track_uri=results['tracks']['items'][0]['id'],
-                                    song=results['tracks']['items'][0]['name'],
-                                    artist=', '.join([i['name'] for i in results['tracks']['items'][0]['artists']]),
-                                    track_duration=track_duration)
+                                                  year_end,
+                                                  deck=deck)
+            if on_pick:
+                on_pick(db_info)
+            if not spotify_info['track_uri']:  # not written back to songbase yet
+                spotify_info = self.resolver.resolve(db_info['song'], db_info['artist'])
+                if spotify_info:
+                    self.cache_spotify_info(db_info, spotify_info)
+            if spotify_info:
+                start_ms = self.get_random_start_point(track_duration=spotify_info['track_duration']) if not intro else 0
                 return db_info, spotify_info, start_ms
             else:
                 print('Could not find {0} by {1}'.format(db_info['song'], db_info['artist']))
                 self.log_not_on_spotify(song=db_info['song'], artist=db_info['artist'])
 
     def get_artist_top_songs(self, artist, country='UK', n_songs=5):
-        cleaned_artist = ArtistCleaner(artist).clean_artist()
+        cleaned_artist = clean_artist(artist)
+        top_tracks = self.top_tracks_cache.get((cleaned_artist, country))
+        metrics.cache_lookup('top_tracks', top_tracks is not NOT_CACHED)
+        if top_tracks is NOT_CACHED:
+            top_tracks = self.search_artist_top_songs(cleaned_artist, country)
+            if top_tracks is not None:  # an artist Spotify didn't find is searched for again next time
+                self.top_tracks_cache.set((cleaned_artist, country), top_tracks)
+        return top_tracks
+
+    def search_artist_top_songs(self, cleaned_artist, country):
         result = self.sp_client.search(q='artist:' + cleaned_artist,
                                        limit=1,
                                        type='artist')
@@ -117,53 +133,88 @@ class SpotifyHelper():
 
     @staticmethod
     def cache_spotify_info(db_info, spotify_info):
-        conn = psycopg2.connect(dbname=os.environ['DB_NAME'],
-                                user=os.environ['DB_USER'],
-                                host=os.environ['DB_HOST'],
-                                port=os.environ['DB_PORT'])
-
-        cur = conn.cursor()
-        cur.execute("""
-                UPDATE songbase.weekly_charts
-                SET spotify_track_uri = %s,
-                    spotify_song = %s,
-                    spotify_artist = %s,
-                    spotify_track_duration = %s
-                WHERE song = %s
-                  AND artist = %s
-                  AND (spotify_track_uri IS NULL
-                    OR spotify_song IS NULL
-                    OR spotify_artist IS NULL
-                    OR spotify_track_duration IS NULL
-                    OR (spotify_track_uri IS NOT NULL AND (spotify_song != %s 
-                                                        OR spotify_artist != %s
-                                                        OR spotify_track_duration != %s)))""", ())
-        conn.commit()
-        cur.execute("""REFRESH MATERIALIZED VIEW songbase.song_peaks_mv;""")
-        conn.commit()
-        cur.close()
-        conn.close()
+        songbase.spotify_info_writer.add((db_info['song'], db_info['artist'], spotify_info))
 
     @staticmethod
     def log_not_on_spotify(song, artist):
-        conn = psycopg2.connect(dbname=os.environ['DB_NAME'],
-                                user=os.environ['DB_USER'],
-                                host=os.environ['DB_HOST'],
-                                port=os.environ['DB_PORT'])
-
-        cur = conn.cursor()
-        cur.execute("""
-                INSERT INTO songbase.songs_not_on_spotify (song, artist) 
-                SELECT %s, %s
-                WHERE NOT EXISTS (
-                    SELECT song, artist
-                    FROM songbase.songs_not_on_spotify
-                    WHERE song = %s
-                      AND artist = %s
-                )""", (song, artist, song, artist))
-        conn.commit()
-        cur.close()
-        conn.close()
+        songbase.log_not_on_spotify(song, artist)
+
+
+song_pool = SongPool()
+song_pool.start()
+
+# one token-managed client per process, shared by every request
+spotify_helper = SpotifyHelper(metrics.instrument_spotify(SpotifyClient(
+    auth_manager=SpotifyTokenManager(SpotifyConnector(scopes='user-library-read streaming user-read-playback-state')))),
+    song_pool=song_pool)
+device_registry = DeviceRegistry(spotify_helper.sp_client)
+
+
+wiki_lookup = WikiLookup()
+play_counts = PlayCounts(LastFMHelper())
+# finished /spotify_table contents by (cleaned artist, country), so looking an artist up again calls nothing upstream
+artist_tables = LRUCache(maxsize=app.config['SPOTIFY_TABLE_CACHE_SIZE'], ttl=app.config['SPOTIFY_TABLE_TTL'])
+
+
+def artist_table(artist, country):
+    """
+    (top_tracks, unable_to_find, etag) for /spotify_table. the etag changes whenever the table does. an artist Spotify
+    doesn't know gets an empty table, which isn't cached.
+    """
+    key = (clean_artist(artist), country)
+    table = artist_tables.get(key)
+    metrics.cache_lookup('spotify_table', table is not NOT_CACHED)
+    if table is not NOT_CACHED:
+        return table
+
+    top_tracks = []
+    unable_to_find = []
+    spotify_tracks = spotify_helper.get_artist_top_songs(artist=artist, country=country)
+    tracks = spotify_tracks['tracks'] if spotify_tracks else []
+    last_fm_plays = play_counts.get_many([track['name'] for track in tracks], artist)
+    for track, last_fm_data in zip(tracks, last_fm_plays):
+        if last_fm_data:
+            if 'track' in last_fm_data:
+                top_tracks.append(dict(spotify_data=track,
+                                       last_fm_data=dict(last_fm_data['track'])))  # copy; playcount is reformatted below
+            else:
+                unable_to_find.append(dict(spotify_data=track))
+    top_tracks = sorted(top_tracks, key=lambda x: int(x['last_fm_data']['playcount']), reverse=True)
+    for track in top_tracks:  # format playcounts with commas
+        track['last_fm_data']['playcount'] = f"{int(track['last_fm_data']['playcount']):,}"
+
+    etag = hashlib.sha1(json.dumps([top_tracks, unable_to_find], sort_keys=True).encode('utf-8')).hexdigest()
+    table = (top_tracks, unable_to_find, etag)
+    if spotify_tracks:
+        artist_tables.set(key, table)
+    return table
+
+
+def fetch_next_song(song_filter):
+    """
+    everything home() needs to play and show the next song for a (max_pos, min_pos, year_start, year_end, intro,
+    deck) filter. the Wikipedia lookup runs alongside the Spotify one.
+    """
+    max_pos, min_pos, year_start, year_end, intro, deck = song_filter
+    wiki_pages = {}
+
+    def start_wiki_lookup(db_info):
+        wiki_pages[db_info['song'], db_info['artist']] = wiki_lookup.start(db_info['song'], db_info['artist'])
+
+    db_info, spotify_info, start_ms = spotify_helper.get_random_spotify_song(max_pos=max_pos,
+                                                                             min_pos=min_pos,
+                                                                             year_start=year_start,
+                                                                             year_end=year_end,
+                                                                             intro=intro,
+                                                                             deck=deck,
+                                                                             on_pick=start_wiki_lookup)
+    return dict(db_info=db_info,
+                spotify_info=spotify_info,
+                start_ms=start_ms,
+                wiki_page=wiki_lookup.result(wiki_pages[db_info['song'], db_info['artist']]))
+
+
+prefetcher = SongPrefetcher(fetch_next_song)
 
 
 @app.route('/', methods=["GET", "POST"])
@@ -180,36 +231,18 @@ def home():
         if form.display_info_by_default.data:
             display_info = 'block'
 
-        spotify_helper = SpotifyHelper()
-        db_info, spotify_info, start_ms = spotify_helper.get_random_spotify_song(max_pos=form.max_position.data,
-                                                                                            min_pos=form.min_position.data,
-                                                                                            year_start=form.start_year.data,
-                                                                                            year_end=form.end_year.data,
-                                                                                            intro=form.intros.data)
-        device_id = None
-        for i in spotify_helper.sp_client.devices()['devices']:
-            if i['name'] == u'Jack\u2019s MacBook Pro':
-                device_id = i['id']
-                break
-        if device_id:
-            spotify_helper.sp_client.start_playback(device_id=device_id,
-                                                    position_ms=start_ms,
-                                                    uris=['spotify:track:' + str(spotify_info['track_uri'])])
-        page_search = "{song} by {artist}".format(song=db_info['song'], artist=db_info['artist'])
-        for page in [page_search, db_info]:
-            try:
-                wiki_page = wikipedia.page(page)
-                wiki_page = wiki_page.url
-                break
-            except:
-                print('Could not get page for {page}'.format(page=page))
-
-        #song_picker.cache_spotify_info(song=song,
-        #                              artist=artist,
-         #                              spotify_track_id=track_uri,
-          #                             spotify_song=spotify_song,
-           #                            spotify_artist=spotify_artist,
-            #                           spotify_track_duration=spotify_track_duration)
+        next_song = prefetcher.get((form.max_position.data,
+                                    form.min_position.data,
+                                    form.start_year.data,
+                                    form.end_year.data,
+                                    form.intros.data,
+                                    form.deck.data))
+        db_info = next_song['db_info']
+        spotify_info = next_song['spotify_info']
+        wiki_page = next_song['wiki_page'] or wiki_lookup.cached(db_info['song'], db_info['artist'])
+        device_registry.start_playback(position_ms=next_song['start_ms'],
+                                       uris=['spotify:track:' + str(spotify_info['track_uri'])])
+
     return render_template('question_writing.html',
                            form=form,
                            db_info=db_info,
@@ -223,68 +256,70 @@ def auth_callback():
     return render_template('question_writing.html')
 
 
-@app.route('/submit_question_answer', methods=["GET", "POST"])
-def submit_question_answer():
-    question = request.form['question']
-    answer = request.form['answer']
-
+def open_question_sheet():
     # use creds to create a client to interact with the Google Drive API
     # scope = ['https://spreadsheets.google.com/feeds']
     scopes = ['https://www.googleapis.com/auth/spreadsheets',
               'https://www.googleapis.com/auth/drive']
     creds = ServiceAccountCredentials.from_json_keyfile_name(os.environ['CLIENT_FILE'], scopes)
-    client = gspread.authorize(creds)
+    with metrics.timed('gspread', 'authorize'):
+        client = gspread.authorize(creds)
 
     # Find a workbook by name and open the first sheet
     # Make sure you use the right name here.
-    sheet = client.open('SpotifyAppMusicQuestions').sheet1
-    sheet.append_row([question, answer])
+    with metrics.timed('gspread', 'open'):
+        return client.open('SpotifyAppMusicQuestions').sheet1
+
+
+# opened once and kept by the queue's worker, which sends submissions on in batches
+question_queue = QuestionQueue(open_question_sheet)
+
+
+@app.route('/submit_question_answer', methods=["GET", "POST"])
+def submit_question_answer():
+    question_queue.put(request.form['question'], request.form['answer'])
     return ''  # errors if view function doesn't even return a str
 
 
+@app.route('/metrics')
+def metrics_page():
+    return Response(metrics.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
 
 @app.route('/spotify_table', methods=["GET", "POST"])
 def spotify_table():
-    form = ArtistPickerForm()
+    # searching is a GET, so that a browser asking for the same artist again can revalidate with If-None-Match, and
+    # has no side effects; playing the top track is the page's separate POST form
+    form = ArtistPickerForm(request.args) if request.method == 'GET' else ArtistPickerForm()
     form.country.choices = ['GB', 'US']
 
     top_tracks = []
     unable_to_find = []
+    etag = None
+
+    if form.artist.data:
+        top_tracks, unable_to_find, etag = artist_table(form.artist.data, form.country.data or 'GB')
+        if request.method == 'POST' and top_tracks:
+            device_registry.start_playback(uris=['spotify:track:' + str(top_tracks[0]['spotify_data']['id'])])
+        if request.method == 'GET' and etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+    response = make_response(render_template('spotify_table.html',
+                                             form=form,
+                                             top_tracks=top_tracks,
+                                             unable_to_find=unable_to_find))
+    if etag:
+        response.set_etag(etag)
+        response.cache_control.no_cache = True  # always check back, so a stale table is never shown without asking
+    return response
+
 
-    if request.method == 'POST':
-        spotify_helper = SpotifyHelper()
-        lastfm_helper = LastFMHelper()
-        spotify_tracks = spotify_helper.get_artist_top_songs(artist=form.artist.data,
-                                                             country=form.country.data)
-        for track in spotify_tracks['tracks']:
-            last_fm_data = lastfm_helper.get_n_plays(track['name'], form.artist.data)
-            if last_fm_data:
-                if 'track' in last_fm_data:
-                    top_tracks.append(dict(spotify_data=track,
-                                           last_fm_data=last_fm_data['track']))
-                else:
-                    unable_to_find.append(dict(spotify_data=track))
-        top_tracks = sorted(top_tracks, key=lambda x: int(x['last_fm_data']['playcount']), reverse=True)
-        for track in top_tracks:  # format playcounts with commas
-            track['last_fm_data']['playcount'] = f"{int(track['last_fm_data']['playcount']):,}"
-        device_id = None
-        for i in spotify_helper.sp_client.devices()['devices']:
-            if i['name'] == u'Jack\u2019s MacBook Pro':
-                device_id = i['id']
-                break
-        if device_id:
-            spotify_helper.sp_client.start_playback(device_id=device_id,
-                                                    uris=['spotify:track:' + str(top_tracks[0]['spotify_data']['id'])])
-
-    return render_template('spotify_table.html',
-                           form=form,
-                           top_tracks=top_tracks,
-                           unable_to_find=unable_to_find)
 """
 TODO
 Cache all the spotify info as a json object
 Make the wiki box size with window
-ADD ABILITY TO CONFIGURE WHETHER SONGS ARE RANDOMIZED OR WHETHER YOU GO SEQUENTIALLY THROUGH ALL OF THEM
 Update Cleaner to remove {year} from the end
 allow cleaner to have multiple tries, and in second try convert number to word
 """
@@ -0,0 +1,33 @@
+"""
+Last.fm play counts for /spotify_table.
+
+Looking up an artist's top tracks means one Last.fm call per track, so the calls are fanned out on a thread pool
+(a cold lookup takes about as long as the slowest call) and every answer is kept for ttl seconds, keyed by
+(track, artist), so looking the same artist up again doesn't call Last.fm at all.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from caching import DAY, NOT_CACHED, LRUCache
+
+
+class PlayCounts(object):
+    def __init__(self, lastfm_helper, ttl=DAY, max_workers=10, maxsize=4096):  # spotify gives up to 10 top tracks
+        self.lastfm_helper = lastfm_helper
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lastfm')
+
+    def get_n_plays(self, track, artist):
+        last_fm_data = self.cache.get((track, artist))
+        metrics.cache_lookup('lastfm', last_fm_data is not NOT_CACHED)
+        if last_fm_data is NOT_CACHED:
+            with metrics.timed('lastfm', 'get_n_plays'):
+                last_fm_data = self.lastfm_helper.get_n_plays(track, artist)
+            self.cache.set((track, artist), last_fm_data)
+        return last_fm_data
+
+    def get_many(self, tracks, artist):
+        """
+        get_n_plays for each of tracks, concurrently. results are in the same order as tracks.
+        """
+        return list(self._pool.map(lambda track: self.get_n_plays(track, artist), tracks))
@@ -0,0 +1,64 @@
+"""
+Keeps the next few quiz songs ready before anyone asks for them.
+
+For each filter (the SongLimiterForm settings) there is a small queue of fully resolved songs. Taking one from the
+queue asks a background worker to top it back up, so the database pick, Spotify search and Wikipedia lookup for the
+next song happen while the current one is playing. If a queue is empty (the first click for a filter, or clicking
+faster than the workers can keep up) the song is resolved on the spot instead.
+"""
+import queue
+import threading
+from collections import OrderedDict
+
+
+class SongPrefetcher(object):
+    def __init__(self, fetch_song, depth=3, workers=2, max_filters=16):
+        """
+        fetch_song(key) must return one fully resolved song for the filter key.
+        """
+        self.fetch_song = fetch_song
+        self.depth = depth
+        self.max_filters = max_filters
+
+        self._queues = OrderedDict()
+        self._filling = set()
+        self._lock = threading.Lock()
+        self._wanted = queue.Queue()
+        for i in range(workers):
+            threading.Thread(target=self._work, name='song-prefetch-{0}'.format(i), daemon=True).start()
+
+    def _queue(self, key):
+        with self._lock:
+            if key not in self._queues:
+                self._queues[key] = queue.Queue(maxsize=self.depth)
+                while len(self._queues) > self.max_filters:  # forget the least recently used filter
+                    self._queues.popitem(last=False)
+            self._queues.move_to_end(key)
+            return self._queues[key]
+
+    def get(self, key):
+        try:
+            song = self._queue(key).get_nowait()
+        except queue.Empty:
+            song = self.fetch_song(key)
+        self._wanted.put(key)
+        return song
+
+    def _work(self):
+        while True:
+            key = self._wanted.get()
+            with self._lock:
+                if key in self._filling:
+                    continue
+                self._filling.add(key)
+            try:
+                songs = self._queue(key)
+                while not songs.full():
+                    songs.put_nowait(self.fetch_song(key))
+            except queue.Full:
+                pass
+            except Exception as e:
+                print('Could not prefetch a song for {0} because: {1}'.format(key, e))
+            finally:
+                with self._lock:
+                    self._filling.discard(key)
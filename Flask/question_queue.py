@@ -0,0 +1,95 @@
+"""
+Quiz questions on their way to the SpotifyAppMusicQuestions sheet.
+
+/submit_question_answer only writes the question to a SQLite table and returns; a background worker sends whatever
+has built up to the sheet in one append_rows call every few seconds. The worksheet handle (and the authorised gspread
+client behind it) is opened once and kept, and only opened again after a failed append, in case it was the
+credentials that went stale. While Google is unreachable the questions stay in the table and the worker backs off,
+so nothing is lost; anything still unsent when the app stops is sent after it starts again.
+
+A question is only deleted once append_rows has returned, so if the app dies in between the same rows are sent
+twice. A duplicate row in the sheet is better than a lost question.
+
+The queue has its own file (QUESTION_QUEUE_PATH), not the track cache's, since that one is safe to delete and this
+one isn't.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+DEFAULT_QUEUE_PATH = os.environ.get('QUESTION_QUEUE_PATH',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'question_queue.sqlite'))
+FLUSH_INTERVAL = 5.0
+MAX_BACKOFF = 300.0
+
+
+class QuestionQueue(object):
+    def __init__(self, open_sheet, path=DEFAULT_QUEUE_PATH, table='question_queue', batch_size=100,
+                 interval=FLUSH_INTERVAL, max_backoff=MAX_BACKOFF):
+        """
+        open_sheet() must return the gspread worksheet to append to.
+        """
+        self.open_sheet = open_sheet
+        self.table = table
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+
+        self._sheet = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS {0} (
+                                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                      question TEXT,
+                                      answer TEXT,
+                                      added_at REAL
+                                  )""".format(table))
+        threading.Thread(target=self._work, name='question-queue', daemon=True).start()
+
+    def put(self, question, answer):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO {0} (question, answer, added_at) VALUES (?, ?, ?)'.format(self.table),
+                               (question, answer, time.time()))
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM {0}'.format(self.table)).fetchone()[0]
+
+    def flush(self):
+        """
+        sends everything queued so far to the sheet, batch_size rows to a call. returns the number of rows sent.
+        """
+        n_sent = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute('SELECT id, question, answer FROM {0} ORDER BY id LIMIT ?'.format(self.table),
+                                          (self.batch_size,)).fetchall()
+            if not rows:
+                return n_sent
+            if self._sheet is None:
+                self._sheet = self.open_sheet()
+            try:
+                with metrics.timed('gspread', 'append_rows'):
+                    self._sheet.append_rows([[question, answer] for _, question, answer in rows])
+            except Exception:
+                self._sheet = None
+                raise
+            with self._lock, self._conn:
+                self._conn.execute('DELETE FROM {0} WHERE id <= ?'.format(self.table), (rows[-1][0],))
+            n_sent += len(rows)
+
+    def _work(self):
+        delay = self.interval
+        while True:
+            time.sleep(delay)
+            try:
+                self.flush()
+                delay = self.interval
+            except Exception as e:
+                delay = min(2 * delay, self.max_backoff)
+                print('Could not send questions to the sheet ({0} waiting), trying again in {1:.0f}s because: {2}'
+                      .format(self.pending(), delay, e))
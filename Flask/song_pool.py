@@ -0,0 +1,118 @@
+"""
+In-memory index of every song in songbase.song_peaks_mv, so picking the next quiz song doesn't need a database
+round-trip (let alone an ORDER BY RANDOM() over the whole view).
+
+Songs are sorted into (year, chart peak) buckets, so the songs matching any year range and peak range are a handful
+of contiguous slices. Those slices are turned into an array of row ids once per filter, after which a random pick is
+O(1). Deck mode deals the same songs in a shuffled order without repeats, reshuffling once they've all been dealt.
+The index is rebuilt in a background thread every refresh_interval seconds and swapped in whole.
+"""
+import random
+import threading
+import time
+
+import numpy as np
+
+import songbase
+from caching import LRUCache
+
+SONG_POOL_QUERY = """
+SELECT
+    song, artist, chart_peak, EXTRACT(YEAR FROM week_start_date)::INT,
+    spotify_track_uri, spotify_song, spotify_artist, spotify_track_duration
+FROM songbase.song_peaks_mv
+"""
+PEAK_SPAN = 1000  # bigger than any chart position, so year * PEAK_SPAN + peak sorts by year then peak
+
+
+class SongIndex(object):
+    """
+    one immutable snapshot of the songs, bucketed by (year, chart peak).
+    """
+    def __init__(self, rows):
+        keys = np.array([row[3] * PEAK_SPAN + row[2] for row in rows], dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        self.rows = [rows[i] for i in order]
+        self.keys = keys[order]
+        self._selections = LRUCache(maxsize=256)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def select(self, max_pos, min_pos, year_start, year_end):
+        """
+        row ids of the songs from year_start to year_end that peaked between max_pos and min_pos.
+        """
+        key = (max_pos, min_pos, year_start, year_end)
+        selection = self._selections.get(key, None)
+        if selection is None:
+            years = np.arange(year_start, year_end + 1, dtype=np.int64) * PEAK_SPAN
+            starts = np.searchsorted(self.keys, years + max_pos, side='left')
+            ends = np.searchsorted(self.keys, years + min_pos, side='right')
+            selection = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)] +
+                                       [np.empty(0, dtype=np.int64)])
+            self._selections.set(key, selection)
+        return selection
+
+    def song(self, row_id):
+        row = self.rows[row_id]
+        db_info = dict(song=row[0],
+                       artist=row[1],
+                       chart_peak=row[2],
+                       year=row[3])
+        spotify_info = dict(track_uri=row[4],
+                            song=row[5],
+                            artist=row[6],
+                            track_duration=row[7])
+        return db_info, spotify_info
+
+
+class SongPool(object):
+    def __init__(self, refresh_interval=60 * 60):
+        self.refresh_interval = refresh_interval
+        self.index = None
+        self._decks = {}
+        self._lock = threading.Lock()
+
+    def reload(self):
+        self.index = SongIndex(songbase.query(SONG_POOL_QUERY))
+
+    def _keep_fresh(self):
+        while True:
+            try:
+                self.reload()
+            except Exception as e:
+                print('Could not load the song pool because: {0}'.format(e))
+            time.sleep(self.refresh_interval)
+
+    def start(self):
+        """
+        loads the index and keeps reloading it, all in a daemon thread. until the first load finishes self.index is
+        None and callers should go to the database instead.
+        """
+        threading.Thread(target=self._keep_fresh, name='song-pool', daemon=True).start()
+
+    def random_song(self, max_pos, min_pos, year_start, year_end):
+        """
+        (db_info, spotify_info) for a random matching song, or None if nothing matches.
+        """
+        index = self.index
+        selection = index.select(max_pos, min_pos, year_start, year_end)
+        if not len(selection):
+            return None
+        return index.song(selection[random.randrange(len(selection))])
+
+    def deal(self, max_pos, min_pos, year_start, year_end):
+        """
+        like random_song, but doesn't repeat a song until every matching song has been dealt.
+        """
+        index = self.index
+        key = (max_pos, min_pos, year_start, year_end)
+        with self._lock:
+            deck_index, deck, position = self._decks.get(key, (None, None, 0))
+            if deck_index is not index or position >= len(deck):
+                deck_index, deck, position = index, np.random.permutation(index.select(*key)), 0
+            if not len(deck):
+                return None
+            self._decks[key] = (deck_index, deck, position + 1)
+        return index.song(deck[position])
@@ -1,6 +1,12 @@
 import os
+import threading
+import time
 import requests
 import spotipy.util as util
+from spotipy.oauth2 import SpotifyOAuth
+
+DEFAULT_DEVICE_NAME = u'Jack\u2019s MacBook Pro'
+DEVICE_NOT_FOUND = 404
 
 
 class SpotifyConnector(object):
@@ -29,70 +35,78 @@ class SpotifyConnector(object):
         return token
 
 
-class SpotifyCleaner(object):
-    def __init__(self, to_be_cleaned):
-        self.to_be_cleaned = to_be_cleaned.lower()
-        self.bad_symbols = ['{', '!', ',', '...', '(']
-        self.feat_keywords = [' ft ', ' feat ', ' featuring ', ' ft. ', ' feat. ']  # must have space separation
-
-    def remove_featuring(self, to_clean):
-        for word in self.feat_keywords:
-            if word in to_clean:
-                split_word = to_clean.split(word)
-                return split_word[0], split_word[1]
-        return to_clean, None
-
-    def remove_unnecessary_symbols(self, to_clean):
-        for symbol in self.bad_symbols:
-            if symbol in to_clean:
-                return to_clean.split(symbol)[0]
-        return to_clean
-
-    def rm_apostrophe(self, to_clean):
-        return to_clean.replace('\'', '')
-
-
-    @staticmethod
-    def sep_multiples(word, separator):
-        if separator in word:
-            separated = word.split(separator)
-            return separated[0], separated[1]
-        else:
-            return word, None
-
-
-class SongCleaner(SpotifyCleaner):
+class SpotifyTokenManager(object):
     """
-    create a SongCleaner object and then call its clean_song() method.
+    auth_manager for spotipy.Spotify that holds one user token for the whole process, shared by every request
+    thread. the token is refreshed once it is within refresh_margin seconds of expiring rather than after it has
+    expired, so requests never wait on an expired token.
     """
-    def __init__(self, song):
-        super(SongCleaner, self).__init__(song)
-
-    def clean_song(self):
-        clean1, _ = self.remove_featuring(self.to_be_cleaned)
-        clean2, _ = self.sep_multiples(clean1, '/')
-        clean3, _ = self.sep_multiples(clean2, '&')
-        clean4 = self.rm_apostrophe(clean3)
-        return self.remove_unnecessary_symbols(clean4)
-
-
-class ArtistCleaner(SpotifyCleaner):
+    def __init__(self, connector, refresh_margin=300):
+        self.connector = connector
+        self.refresh_margin = refresh_margin
+        self.oauth = SpotifyOAuth(client_id=connector.client_id,
+                                  client_secret=connector.client_secret,
+                                  redirect_uri=connector.redirect_uri,
+                                  scope=connector.scopes,
+                                  username=connector.username)  # same token cache as util.prompt_for_user_token
+        self._token_info = None
+        self._lock = threading.Lock()
+
+    def _expiring(self, token_info):
+        return token_info['expires_at'] - time.time() < self.refresh_margin
+
+    def _fetch_token(self):
+        token_info = self.oauth.validate_token(self.oauth.cache_handler.get_cached_token())
+        if token_info is None:
+            self.connector.get_token()  # first run: log in and fill the token cache
+            token_info = self.oauth.validate_token(self.oauth.cache_handler.get_cached_token())
+        if self._expiring(token_info):
+            token_info = self.oauth.refresh_access_token(token_info['refresh_token'])
+        return token_info
+
+    def get_access_token(self, as_dict=False):
+        with self._lock:
+            if self._token_info is None or self._expiring(self._token_info):
+                self._token_info = self._fetch_token()
+            return self._token_info if as_dict else self._token_info['access_token']
+
+
+class DeviceRegistry(object):
     """
-    create an ArtistCleaner object and then call its clean_artist() method.
+    remembers which Spotify Connect device to play on. the device is picked by name (SPOTIFY_DEVICE_NAME, or
+    DEFAULT_DEVICE_NAME); its id is looked up once and reused, and only looked up again when playback fails because
+    Spotify no longer knows the device.
     """
-    def __init__(self, artist):
-        super(ArtistCleaner, self).__init__(artist)
-
-    def remove_the(self, stri):
-        start = 'the'
-        if stri.startswith(start+' '):
-            return stri[len(start):]
-        return stri
-
-    def clean_artist(self):
-        main_artist, featured_artist = self.remove_featuring(self.to_be_cleaned)
-        cleaned_main_artist = self.remove_unnecessary_symbols(main_artist)
-        clean1_main, _ = self.sep_multiples(cleaned_main_artist, '/')
-        clean2_main, _ = self.sep_multiples(clean1_main, '&')
-        clean3 = self.rm_apostrophe(clean2_main)
-        return self.remove_the(clean3)
+    def __init__(self, sp_client, device_name=None):
+        self.sp_client = sp_client
+        self.device_name = device_name or os.environ.get('SPOTIFY_DEVICE_NAME', DEFAULT_DEVICE_NAME)
+        self._device_id = None
+        self._lock = threading.Lock()
+
+    def device_id(self, refresh=False):
+        with self._lock:
+            if self._device_id is None or refresh:
+                self._device_id = None
+                for i in self.sp_client.devices()['devices']:
+                    if i['name'] == self.device_name:
+                        self._device_id = i['id']
+                        break
+            return self._device_id
+
+    def start_playback(self, **kwargs):
+        """
+        sp_client.start_playback on the device. returns False if the device isn't available.
+        """
+        device_id = self.device_id()
+        if device_id is None:
+            return False
+        try:
+            self.sp_client.start_playback(device_id=device_id, **kwargs)
+        except Exception as e:
+            if getattr(e, 'http_status', None) != DEVICE_NOT_FOUND:
+                raise
+            device_id = self.device_id(refresh=True)
+            if device_id is None:
+                return False
+            self.sp_client.start_playback(device_id=device_id, **kwargs)
+        return True
@@ -0,0 +1,102 @@
+"""
+Wikipedia lookups for the quiz page.
+
+Lookups run on their own small thread pool so they can overlap with the Spotify calls, and callers only wait up to
+timeout seconds for an answer; a lookup that takes longer keeps going in the background and lands in the cache for
+next time. Results, including "there's no page", are cached on disk by (song, artist).
+
+Pages are found with the MediaWiki API directly (the wikipedia package can't be given a timeout), and each request
+gives up after HTTP_TIMEOUT, so a hung connection can't hold a worker for good. At most max_pending lookups are
+queued or running; past that a song just gets no link this time.
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+import requests
+
+import metrics
+from caching import DAY, NOT_CACHED, SqliteCache, TieredCache
+
+API_URL = 'https://en.wikipedia.org/w/api.php'
+USER_AGENT = 'spotify-songbase'
+WIKI_TIMEOUT = 2.0
+HTTP_TIMEOUT = (3.05, 10)  # connect, read
+PAGE_QUERIES = ('{song} by {artist}', '{song} (song)')
+
+
+class WikiLookup(object):
+    def __init__(self, cache=None, timeout=WIKI_TIMEOUT, workers=4, max_pending=16, ttl=90 * DAY, miss_ttl=7 * DAY,
+                 http_timeout=HTTP_TIMEOUT):
+        self.cache = cache or TieredCache(SqliteCache(table='wiki_pages'))
+        self.timeout = timeout
+        self.http_timeout = http_timeout
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wiki')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._session = requests.Session()
+        self._session.headers['User-Agent'] = USER_AGENT
+
+    def search(self, query):
+        """
+        the url of the top search result for query, or None if there isn't one or it's a disambiguation page.
+        """
+        with metrics.timed('wikipedia', 'page'):
+            response = self._session.get(API_URL, params=dict(action='query', format='json', redirects=1,
+                                                              generator='search', gsrsearch=query, gsrlimit=1,
+                                                              prop='info|pageprops', inprop='url',
+                                                              ppprop='disambiguation'),
+                                         timeout=self.http_timeout)
+            response.raise_for_status()
+        for page in response.json().get('query', {}).get('pages', {}).values():
+            if 'disambiguation' not in page.get('pageprops', {}):
+                return page['fullurl']
+        return None
+
+    def find_page(self, song, artist):
+        """
+        the url of the song's Wikipedia page, or None if there isn't one. always goes to Wikipedia.
+        """
+        for query in PAGE_QUERIES:
+            url = self.search(query.format(song=song, artist=artist))
+            if url:
+                return url
+            print('Could not get page for {0}'.format(query.format(song=song, artist=artist)))
+        return None
+
+    def _find_and_cache(self, song, artist):
+        url = self.find_page(song, artist)
+        self.cache.set((song, artist), url, ttl=self.ttl if url else self.miss_ttl)
+        return url
+
+    def cached(self, song, artist):
+        url = self.cache.get((song, artist))
+        return None if url is NOT_CACHED else url
+
+    def start(self, song, artist):
+        """
+        starts looking up the page and returns a Future for its url.
+        """
+        url = self.cache.get((song, artist))
+        metrics.cache_lookup('wiki', url is not NOT_CACHED)
+        future = Future()
+        if url is not NOT_CACHED:
+            future.set_result(url)
+        elif self._pending.acquire(blocking=False):
+            future = self._pool.submit(self._find_and_cache, song, artist)
+            future.add_done_callback(lambda _: self._pending.release())
+        else:  # Wikipedia is slow enough that lookups are piling up; do without this one
+            future.set_result(None)
+        return future
+
+    def result(self, future):
+        """
+        the url from start(), or None if it isn't there within the time budget (or the lookup failed).
+        """
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            return None
+        except Exception as e:
+            print('Wikipedia lookup failed because: {0}'.format(e))
+            return None
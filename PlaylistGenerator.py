@@ -1,9 +1,16 @@
+import argparse
 import os
 
-import psycopg2
-import spotipy
 import spotipy.util as util
 from scraping.utils import load_env_from_env_file
+import metrics
+import songbase
+from caching import track_cache
+from pipeline import Pipeline, Stage
+from playlist_index import playlist_index
+from playlist_sync import sync_playlist
+from cleaning import clean_song, clean_artist
+from track_resolver import SEARCH_FAILED, SpotifyClient, TrackResolver
 
 
 class SpotifyConnector(object):
@@ -36,141 +43,60 @@ class PlaylistGenerator(SpotifyConnector):
         self.query_results = query_results
 
         self.token = self.get_token()
-        self.sp_client = spotipy.Spotify(auth=self.token)
+        self.sp_client = metrics.instrument_spotify(SpotifyClient(auth=self.token))
+        self.resolver = TrackResolver(self.sp_client, cache=track_cache())
+        self.playlists = playlist_index(self.username)
         self.missed_list = []
 
     def find_playlist_id(self, name):
-        playlists = self.sp_client.current_user_playlists()
-        for playlist in playlists['items']:
-            if playlist['name'] == name:
-                return str(playlist['id'])
+        return self.playlists.find(self.sp_client, name)
+
+    def record(self, resolved):
+        (song, artist), info = resolved
+        if info is SEARCH_FAILED:  # not a miss; it's searched for again next run
+            return None
+        if info:
+            return info['track_uri']
+        self.missed_list.append({'song': song, 'artist': artist})
+        songbase.log_not_on_spotify(song, artist)
+        return None
 
     def generate_playlist(self):
         if self.token:
-
-            self.sp_client.user_playlist_create(self.username, self.playlist_name, public=self.is_public)
-            playlist_id = self.find_playlist_id(self.playlist_name)
-
-            query_result = self.query_results
-
-            for row in query_result:
-                song, artist = self.clean_song_artist(uncleaned_song=row[1],
-                                                      uncleaned_artist=row[0])
-                try:
-                    ids = self.find_spotify_uri(song=song, artist=artist)
-                    self.sp_client.user_playlist_add_tracks(self.username, playlist_id, tracks=[ids])
-                except:
-                    self.missed_list.append({'song': song, 'artist': artist})
+            playlist_id = self.playlists.find_or_create(self.sp_client, self.playlist_name, public=self.is_public)
+            pairs = ((row[1], row[0]) + tuple(row[2:3]) for row in self.query_results)  # with any known spotify_info
+            tracks = Pipeline(*self.resolver.stages(), Stage(self.record, name='record')).run(pairs)
+            track_ids = [track_id for track_id in tracks if track_id]
+            sync_playlist(self.sp_client, self.username, playlist_id, track_ids)
         else:
             print("Can't get token for {}".format(self.username))
 
     def find_spotify_uri(self, song, artist):
-        results = self.sp_client.search(q='artist:' + artist + ' AND track:' + song,
-                                        limit=1,
-                                        type='track')
-        return results['tracks']['items'][0]['id']
+        """
+        the song's track id, or None if it isn't on Spotify.
+        """
+        info = self.resolver.resolve(song, artist)
+        return info['track_uri'] if info else None
 
     @staticmethod
     def clean_song_artist(uncleaned_song, uncleaned_artist):
-        song_cleaner = SongCleaner(uncleaned_song)
-        cleaned_song = song_cleaner.clean_song()
-        artist_cleaner = ArtistCleaner(uncleaned_artist)
-        cleaned_artist = artist_cleaner.clean_artist()
-        return cleaned_song, cleaned_artist
-
-
-class SpotifyCleaner(object):
-    def __init__(self, to_be_cleaned):
-        self.to_be_cleaned = to_be_cleaned.lower()
-        self.bad_symbols = ['{', '!', ',', '...', '(']
-        self.feat_keywords = [' ft ', ' feat ', ' featuring ', ' ft. ', ' feat. ']  # must have space separation
-
-    def remove_featuring(self, to_clean):
-        for word in self.feat_keywords:
-            if word in to_clean:
-                split_word = to_clean.split(word)
-                return split_word[0], split_word[1]
-        return to_clean, None
-
-    def remove_unnecessary_symbols(self, to_clean):
-        for symbol in self.bad_symbols:
-            if symbol in to_clean:
-                return to_clean.split(symbol)[0]
-        return to_clean
-
-    def rm_apostrophe(self, to_clean):
-        return to_clean.replace('\'', '')
-
-    @staticmethod
-    def sep_multiples(word, separator):
-        if separator in word:
-            separated = word.split(separator)
-            return separated[0], separated[1]
-        else:
-            return word, None
-
-
-class SongCleaner(SpotifyCleaner):
-    """
-    create a SongCleaner object and then call its clean_song() method.
-    """
-    def __init__(self, song):
-        super(SongCleaner, self).__init__(song)
-
-    def clean_song(self):
-        clean1, _ = self.remove_featuring(self.to_be_cleaned)
-        clean2, _ = self.sep_multiples(clean1, '/')
-        clean3, _ = self.sep_multiples(clean2, '&')
-        clean4 = self.rm_apostrophe(clean3)
-        return self.remove_unnecessary_symbols(clean4)
-
-
-class ArtistCleaner(SpotifyCleaner):
-    """
-    create an ArtistCleaner object and then call its clean_artist() method.
-    """
-    def __init__(self, artist):
-        super(ArtistCleaner, self).__init__(artist)
-
-    def remove_the(self, stri):
-        start = 'the'
-        if stri.startswith(start+' '):
-            return stri[len(start):]
-        return stri
-
-    def clean_artist(self):
-        main_artist, featured_artist = self.remove_featuring(self.to_be_cleaned)
-        cleaned_main_artist = self.remove_unnecessary_symbols(main_artist)
-        clean1_main, _ = self.sep_multiples(cleaned_main_artist, '/')
-        clean2_main, _ = self.sep_multiples(clean1_main, '&')
-        clean3 = self.rm_apostrophe(clean2_main)
-        return self.remove_the(clean3)
+        return clean_song(uncleaned_song), clean_artist(uncleaned_artist)
 
 
 def write_query(data_year, high_peak, low_peak):
     """
-    Note: Query should return just two columns, the first being the artists you want, the second being the songs.
+    Note: Query should return the artists you want first and the songs second, then optionally the songs' known
+    spotify_info (None if they haven't been resolved), which saves searching for them.
     """
-    query = """
-    SELECT artist, song 
-FROM songbase.song_peaks_mv 
-WHERE chart_peak BETWEEN %s AND %s AND 
-EXTRACT(YEAR FROM week_start_date) = %s
-"""
-    conn = psycopg2.connect(dbname=os.environ['DB_NAME'],
-                            user=os.environ['DB_USER'],
-                            host=os.environ['DB_HOST'],
-                            port=os.environ['DB_PORT'])
-    cur = conn.cursor()
-    cur.execute(query, (high_peak, low_peak, data_year))
-    result = cur.fetchall()
-    conn.commit()
-    cur.close()
-    conn.close()
-    return result
+    return songbase.fetch_songs(high_peak, low_peak, data_year)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds a playlist of each year\'s hits.')
+    metrics.add_profile_argument(parser)
+    args = parser.parse_args()
+    metrics.profile_stages(args.profile)
+
     load_env_from_env_file()
     start_year = 2020
     end_year = 2020
@@ -185,4 +111,6 @@ if __name__ == '__main__':
             print('=============== Missed songs from {0} ==============='.format(year))
             for i in gen.missed_list:
                 print(i['song'] + ' by ' + i['artist'])
+    songbase.not_on_spotify_writer.flush()
+    metrics.print_report(profile=args.profile)
 
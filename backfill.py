@@ -0,0 +1,91 @@
+"""
+Resolves every chart song that doesn't have a Spotify track yet, ahead of time.
+
+    python backfill.py [--batch-size 500] [--rate 10] [--limit 5000] [--restart] [--retry-misses] [--profile]
+
+Distinct (song, artist) pairs with no spotify_track_uri are read from song_peaks_mv in (song, artist) order, a batch
+at a time, and resolved with the usual cleaners and TrackResolver (through the track cache), with Spotify searches
+held to --rate a second. Each batch is written back in one transaction (songbase.backfill_spotify_info) along with
+the last pair it covered, so a stopped backfill carries on from there; a search that fails outright stops the run
+rather than being recorded as a miss. Once the whole view has been covered the watermark is cleared and song_peaks_mv
+refreshed, after which the playlist generators and the quiz page find every song Spotify has already in songbase.
+
+Songs Spotify doesn't have go into songs_not_on_spotify and are skipped next time unless --retry-misses is given.
+Run sql/backfill_watermarks.sql once first.
+"""
+import argparse
+import os
+
+from spotipy.oauth2 import SpotifyClientCredentials
+
+import metrics
+import songbase
+from caching import track_cache
+from rate_limiter import AdaptiveRateLimiter
+from scraping.utils import load_env_from_env_file
+from track_resolver import SpotifyClient, TrackResolver
+
+JOB = 'spotify_info'
+
+
+def backfill(resolver, batch_size=500, limit=None, skip_known_misses=True, job=JOB):
+    """
+    resolves and writes back up to limit unresolved songs (all of them if limit is None), starting from the job's
+    watermark. returns (songs looked at, songs found).
+    """
+    watermark = songbase.get_watermark(job)
+    n_songs = n_found = 0
+    while limit is None or n_songs < limit:
+        pairs = songbase.fetch_unresolved_songs(after=watermark,
+                                                limit=batch_size if limit is None else min(batch_size, limit - n_songs),
+                                                skip_known_misses=skip_known_misses)
+        if not pairs:
+            songbase.clear_watermark(job)  # done; the next backfill starts from the top
+            break
+        hits, misses = [], []
+        for (song, artist), info in resolver.stream(pairs, strict=True):
+            if info:
+                hits.append((song, artist, info))
+            else:
+                misses.append((song, artist))
+        watermark = pairs[-1]
+        songbase.backfill_spotify_info(hits, misses, job, watermark)
+        n_songs += len(pairs)
+        n_found += len(hits)
+        print('{0:,} songs, {1:,} found on Spotify; up to {2} by {3}'.format(n_songs, n_found, *watermark))
+    return n_songs, n_found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resolves every chart song without a Spotify track yet.')
+    parser.add_argument('--batch-size', type=int, default=500, help='songs written back per transaction')
+    parser.add_argument('--rate', type=float, default=10.0, help='most Spotify searches a second')
+    parser.add_argument('--workers', type=int, default=4, help='searches in flight at once')
+    parser.add_argument('--limit', type=int, default=None, help='stop after this many songs')
+    parser.add_argument('--restart', action='store_true', help='ignore the watermark and start from the top')
+    parser.add_argument('--retry-misses', action='store_true', help='search again for songs known not to be there')
+    metrics.add_profile_argument(parser)
+    args = parser.parse_args()
+    metrics.profile_stages(args.profile)
+
+    load_env_from_env_file()
+    rate_limiter = AdaptiveRateLimiter(rate=min(5.0, args.rate), max_rate=args.rate, name='spotify')
+    sp_client = metrics.instrument_spotify(SpotifyClient(
+        auth_manager=SpotifyClientCredentials(client_id=os.environ['SPOTIFY_CLIENT_ID'],
+                                              client_secret=os.environ['SPOTIFY_CLIENT_SECRET']),
+        rate_limiter=rate_limiter))
+    resolver = TrackResolver(sp_client, max_workers=args.workers, cache=track_cache())
+
+    if args.restart:
+        songbase.clear_watermark(JOB)
+    n_songs, n_found = backfill(resolver, batch_size=args.batch_size, limit=args.limit,
+                                skip_known_misses=not args.retry_misses)
+    if n_found:
+        songbase.refresh_song_peaks()
+    print('Resolved {0:,} songs with {1:,} searches ({2:,} saved by sharing lookups); {3:,} found on Spotify'.format(
+        n_songs, resolver.search_calls, resolver.searches_saved, n_found))
+    metrics.print_report(profile=args.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Micro-benchmark for the cleaning engine against the per-row SongCleaner/ArtistCleaner classes it replaced.
+
+    python benchmarks/bench_cleaning.py [n_rows]
+
+The old classes are kept below, verbatim from spotify_playlist_generator, as the reference implementation. The
+benchmark checks both produce identical output before timing them.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cleaning
+
+ARTISTS = ['The Beatles', 'Cliff Richard & The Shadows', 'Frankie Laine', 'Jimmie Rodgers', 'Les Paul And Mary Ford',
+           'David Guetta ft Sia', 'Calvin Harris feat. Rihanna', 'Nat \'King\' Cole', 'Bing Crosby With Grace Kelly',
+           'The Rolling Stones', 'Drake featuring Rihanna', 'Simon & Garfunkel', 'Mark Ronson ft. Bruno Mars',
+           'Dolly Parton - Kenny Rogers', 'Elvis Presley (With The Jordanaires)']
+SONGS = ['Here In My Heart', 'You Belong To Me', 'Mockin\' Bird Hill', '99 Ways', 'Paralysed (Live)',
+         'Don\'t Stop Me Now!', 'Yes Sir, I Can Boogie', 'Where Are You Now?', 'Baby Love/Come See About Me',
+         'Ebony & Ivory', 'Hey Jude [Remastered]', 'Unchained Melody {1955}', 'Wait... For Me', 'Walk On By']
+
+
+class SpotifyCleaner(object):
+    """
+    issues noticed
+      - numbers (e.g. 99 ways vs. ninety-nine ways) -- possibly use the inflect library https://stackoverflow.com/questions/8982163/how-do-i-tell-python-to-convert-integers-into-words
+      - americanisms (paralyzed vs. paralysed) -- dunno, maybe a python lib?
+      - misspellings (jimmie rodgers vs. jimmy rodgers) - dunno..
+      - spotify apostrophes (where they have an apostrophe in their name, but we don't, e.g. Mocking Bird Hill vs. Mockin' Bird Hill) - dunno..
+    """
+    def __init__(self, to_be_cleaned):
+        self.to_be_cleaned = to_be_cleaned.lower()
+        self.symbols_to_cut_off_after = ['!', ',', '...', '?', '(', '{', '[']
+        self.feat_keywords = [' ft ', ' feat ', ' featuring ', ' ft. ', ' feat. ']  # must have space separation
+
+    def remove_featuring(self, to_clean):
+        for word in self.feat_keywords:
+            if word in to_clean:
+                split_word = to_clean.split(word)
+                return split_word[0], split_word[1]
+        return to_clean, None
+
+    def remove_unnecessary_symbols(self, to_clean):
+        for symbol in self.symbols_to_cut_off_after:
+            if symbol in to_clean:
+                return to_clean.split(symbol)[0]
+        return to_clean
+
+    def remove_brackets(self, to_clean):
+        brackets = ['{}', '[]', '()']
+        for bracket in brackets:
+            if bracket[0] in to_clean and bracket[1] in to_clean:
+                to_clean = to_clean[:to_clean.index(bracket[0])] + to_clean[to_clean.index(bracket[1]) + 1:]
+        return to_clean
+
+    def rm_apostrophe(self, to_clean):
+        return to_clean.replace('\'', '')
+
+
+    @staticmethod
+    def sep_multiples(word, separator):
+        if separator in word:
+            separated = word.split(separator)
+            return separated[0], separated[1]
+        else:
+            return word, None
+
+
+class SongCleaner(SpotifyCleaner):
+    """
+    create a SongCleaner object and then call its clean_song() method.
+    """
+    def __init__(self, song):
+        super(SongCleaner, self).__init__(song)
+
+    def clean_song(self):
+        clean0 = self.remove_brackets(self.to_be_cleaned)  # do this first
+        clean1, _ = self.remove_featuring(clean0)
+        clean2, _ = self.sep_multiples(clean1, '/')
+        clean3, _ = self.sep_multiples(clean2, '&')
+        clean4 = self.rm_apostrophe(clean3)
+        return self.remove_unnecessary_symbols(clean4).strip()
+
+
+class ArtistCleaner(SpotifyCleaner):
+    """
+    create an ArtistCleaner object and then call its clean_artist() method.
+    """
+    def __init__(self, artist):
+        super(ArtistCleaner, self).__init__(artist)
+
+    def remove_the(self, stri):
+        start = 'the'
+        if stri.strip().startswith(start+' '):
+            return stri[len(start):].strip()
+        return stri
+
+    def remove_extra_credits(self, stri):
+        conjunctions = [' with ', ' and ', ' starring ', ' - ']  # spaces important, e.g. Andy Williams
+        for con in conjunctions:
+            stri = stri.split(con)[0].strip()
+        return stri
+
+    def clean_artist(self):
+        clean0 = self.remove_brackets(self.to_be_cleaned)  # do this first
+        main_artist, featured_artist = self.remove_featuring(clean0)
+        definite_main_artist = self.remove_extra_credits(main_artist)
+        cleaned_main_artist = self.remove_unnecessary_symbols(definite_main_artist)
+        clean1_main, _ = self.sep_multiples(cleaned_main_artist, '/')
+        clean2_main, _ = self.sep_multiples(clean1_main, '&')
+        clean3 = self.rm_apostrophe(clean2_main)
+        return self.remove_the(clean3).strip()
+
+
+def chart_rows(n, seed=1952):
+    """
+    (artist, song) rows with about the amount of repetition a multi-year run sees.
+    """
+    rng = random.Random(seed)
+    return [(rng.choice(ARTISTS) + (' ' + str(rng.randint(1, 300)) if rng.random() < .5 else ''),
+             rng.choice(SONGS) + (' ' + str(rng.randint(1, 300)) if rng.random() < .5 else ''))
+            for _ in range(n)]
+
+
+def legacy_clean_many(rows):
+    return [(SongCleaner(row[1].lower()).clean_song(), ArtistCleaner(row[0].lower()).clean_artist()) for row in rows]
+
+
+def timed(func, rows, repeat=3):
+    best = None
+    for _ in range(repeat):
+        cleaning.clean_song.cache_clear()
+        cleaning.clean_artist.cache_clear()
+        start = time.perf_counter()
+        func(rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(rows) / best
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = chart_rows(n_rows)
+    if legacy_clean_many(rows) != cleaning.clean_many(rows):
+        raise Exception('cleaning engine output differs from the legacy cleaners')
+
+    legacy = timed(legacy_clean_many, rows)
+    engine = timed(cleaning.clean_many, rows)
+    print('{0:<24}{1:>14,.0f} rows/sec'.format('SongCleaner/ArtistCleaner', legacy))
+    print('{0:<24}{1:>14,.0f} rows/sec ({2:.1f}x)'.format('cleaning.clean_many', engine, engine / legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+End-to-end throughput of spotify_playlist_generator against the fake services and the seeded songbase fixture.
+
+    python benchmarks/bench_pipeline.py [--years 1990 1991] [--latency 0.03] [--jitter 0.02] [--throttle 0.02]
+
+Needs a Postgres server (DB_USER, DB_HOST, DB_PORT, DB_PASSWORD as for songbase); the data goes into its own
+database (see fixture.py). The same years are generated four times:
+
+  cold     empty track cache, playlists created from scratch
+  warm     track cache full, playlists already built, so every year is resolved and diffed but nothing is written
+  record   as warm, filling in a checkpoint journal
+  journal  the same again, so every year is unchanged and skipped outright
+
+and each run reports chart rows, tracks/sec, Spotify calls per track (all endpoints, and searches alone) and the
+number of 429s served.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_DIR = tempfile.mkdtemp(prefix='songbase-bench-')
+os.environ['TRACK_CACHE_PATH'] = os.path.join(BENCH_DIR, 'track_cache.sqlite')  # before caching is imported
+for name in ('SPOTIFY_USERNAME', 'SPOTIFY_CLIENT_ID', 'SPOTIFY_CLIENT_SECRET', 'SPOTIFY_REDIRECT_URI'):
+    os.environ.setdefault(name, 'bench')
+
+import fixture
+from fake_services import FakeServices
+
+fixture.use_bench_database()
+
+import songbase
+import spotify_playlist_generator
+from playlist_sync import PlaylistJournal
+
+CHART_MIN = 1
+CHART_MAX = 40
+
+
+class BenchPlaylistGenerator(spotify_playlist_generator.PlaylistGenerator):
+    url = None
+
+    def get_token(self):
+        return 'bench-token'
+
+    def __init__(self, *args, **kwargs):
+        super(BenchPlaylistGenerator, self).__init__(*args, **kwargs)
+        self.sp_client.prefix = self.url + '/v1/'
+
+
+def run(label, services, year_start, year_end, journal=None):
+    services.reset_counts()
+    n_rows = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # "Could not find ..." for every miss
+        for year, rows in songbase.stream_songs_by_year(CHART_MIN, CHART_MAX, year_start, year_end):
+            n_rows += len(rows)
+            BenchPlaylistGenerator('{0}: Songs that peaked between {1} and {2}'.format(year, CHART_MIN, CHART_MAX),
+                                   rows, year, journal=journal).generate_playlist()
+        songbase.spotify_info_writer.flush()
+        songbase.not_on_spotify_writer.flush()
+    elapsed = time.perf_counter() - start
+    searches = services.calls['spotify GET search']
+    print('{0:<10}{1:>8,}{2:>10.2f}{3:>12,.1f}{4:>12.2f}{5:>12.2f}{6:>8,}'.format(
+        label, n_rows, elapsed, n_rows / elapsed, services.api_calls() / max(n_rows, 1),
+        searches / max(n_rows, 1), services.throttled))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--years', nargs=2, type=int, default=(1990, 1991), metavar=('START', 'END'))
+    parser.add_argument('--songs', type=int, default=6000, help='songs in the fixture')
+    parser.add_argument('--seed', type=int, default=fixture.BENCH_SEED)
+    parser.add_argument('--latency', type=float, default=0.03, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.02, help='up to this many more seconds per request')
+    parser.add_argument('--throttle', type=float, default=0.0, help='share of Spotify requests answered with a 429')
+    args = parser.parse_args()
+
+    songs = fixture.chart_songs(seed=args.seed, n_songs=args.songs)
+    print('seeded {0:,} chart rows into {1}'.format(fixture.seed_songbase(songs), fixture.BENCH_DB_NAME))
+    songbase.refresh_song_peaks()
+
+    with FakeServices(fixture.catalogue(songs), latency=args.latency, jitter=args.jitter,
+                      throttle_rate=args.throttle, seed=args.seed) as services:
+        BenchPlaylistGenerator.url = services.url
+        print('{0:<10}{1:>8}{2:>10}{3:>12}{4:>12}{5:>12}{6:>8}'.format(
+            'run', 'rows', 'seconds', 'tracks/sec', 'calls/track', 'search/trk', '429s'))
+        run('cold', services, *args.years)
+        run('warm', services, *args.years)
+        journal = PlaylistJournal(os.path.join(BENCH_DIR, 'playlist_journal.json'))
+        run('record', services, *args.years, journal=journal)
+        run('journal', services, *args.years, journal=journal)
+
+
+if __name__ == '__main__':
+    main()
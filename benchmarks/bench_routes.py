@@ -0,0 +1,125 @@
+"""
+Latency of the Flask app's routes against the fake services and the seeded songbase fixture.
+
+    python benchmarks/bench_routes.py [--requests 200] [--think 0.05] [--latency 0.03] [--throttle 0.02]
+
+Needs a Postgres server, as bench_pipeline.py does. The app is imported as is and its Spotify client, Last.fm helper
+and Wikipedia lookup are pointed at the fake server. Each route is then requested --requests times through Flask's
+test client, --think seconds apart, like someone clicking through a quiz. /spotify_table is also requested again
+with the ETag from an earlier answer, as a browser revalidating its copy would. The report gives p50/p99/max latency
+and Spotify calls per request for each route.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'Flask'))
+
+BENCH_DIR = tempfile.mkdtemp(prefix='songbase-bench-')
+os.environ['TRACK_CACHE_PATH'] = os.path.join(BENCH_DIR, 'track_cache.sqlite')  # before caching is imported
+os.environ['QUESTION_QUEUE_PATH'] = os.path.join(BENCH_DIR, 'question_queue.sqlite')
+for name in ('SPOTIFY_USERNAME', 'SPOTIFY_CLIENT_ID', 'SPOTIFY_CLIENT_SECRET', 'SPOTIFY_REDIRECT_URI'):
+    os.environ.setdefault(name, 'bench')
+
+import requests
+
+import fixture
+import metrics
+from fake_services import BENCH_DEVICE_NAME, FakeServices, LastFMClient, spotify_client
+
+fixture.use_bench_database()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def wiki_page(url):
+    session = requests.Session()
+
+    def find_page(song, artist):
+        return session.get(url + '/wiki', params=dict(song=song, artist=artist)).json()['url']
+    return find_page
+
+
+def time_route(label, services, send, n_requests, think, status=200):
+    services.reset_counts()
+    latencies = []
+    for i in range(n_requests):
+        start = time.perf_counter()
+        response = send(i)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != status:
+            raise RuntimeError('{0} returned {1}'.format(label, response.status_code))
+        time.sleep(think)
+    print('{0:<22}{1:>6}{2:>10.1f}{3:>10.1f}{4:>10.1f}{5:>10.1f}{6:>12.2f}'.format(
+        label, n_requests, 1000 * sum(latencies) / n_requests, 1000 * percentile(latencies, 50),
+        1000 * percentile(latencies, 99), 1000 * max(latencies), services.api_calls() / n_requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--think', type=float, default=0.05, help='seconds between requests')
+    parser.add_argument('--songs', type=int, default=6000, help='songs in the fixture')
+    parser.add_argument('--seed', type=int, default=fixture.BENCH_SEED)
+    parser.add_argument('--latency', type=float, default=0.03, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.02, help='up to this many more seconds per request')
+    parser.add_argument('--throttle', type=float, default=0.0, help='share of Spotify requests answered with a 429')
+    args = parser.parse_args()
+
+    songs = fixture.chart_songs(seed=args.seed, n_songs=args.songs)
+    print('seeded {0:,} chart rows into {1}'.format(fixture.seed_songbase(songs), fixture.BENCH_DB_NAME))
+    tracks = fixture.catalogue(songs)
+
+    import app as app_module  # starts loading the song pool from the fixture
+    with FakeServices(tracks, latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle,
+                      seed=args.seed) as services:
+        sp_client = metrics.instrument_spotify(spotify_client(services.url))  # as the app's own client is
+        app_module.spotify_helper.sp_client = app_module.spotify_helper.resolver.sp_client = sp_client
+        app_module.device_registry.sp_client = sp_client
+        app_module.device_registry.device_name = BENCH_DEVICE_NAME
+        app_module.play_counts.lastfm_helper = LastFMClient(services.url)
+        app_module.wiki_lookup.find_page = wiki_page(services.url)
+        app_module.app.config['WTF_CSRF_ENABLED'] = False
+        client = app_module.app.test_client()
+
+        deadline = time.time() + 60
+        while app_module.song_pool.index is None and time.time() < deadline:
+            time.sleep(0.1)
+
+        rng = random.Random(args.seed)
+        artists = sorted(set(track['artists'][0]['name'] for track in tracks))
+        quiz = dict(max_position='1', min_position='40', start_year='1960', end_year='2000')
+
+        print('{0:<22}{1:>6}{2:>10}{3:>10}{4:>10}{5:>10}{6:>12}'.format(
+            'route', 'n', 'mean ms', 'p50 ms', 'p99 ms', 'max ms', 'calls/req'))
+        time_route('GET /', services, lambda i: client.get('/'), args.requests, 0)
+        time_route('POST /', services, lambda i: client.post('/', data=quiz), args.requests, args.think)
+        time_route('POST / (no repeats)', services, lambda i: client.post('/', data=dict(quiz, deck='y')),
+                   args.requests, args.think)
+        table_artists = [rng.choice(artists) for _ in range(max(1, args.requests // 4))]  # so some are repeats
+        time_route('POST /spotify_table', services,
+                   lambda i: client.post('/spotify_table', data=dict(artist=rng.choice(table_artists),
+                                                                    country=rng.choice(['GB', 'US']))),
+                   args.requests, args.think)
+        tables = dict((key, client.get('/spotify_table', query_string=dict(artist=key[0], country=key[1])).get_etag()[0])
+                      for key in set((artist, country) for artist in table_artists for country in ('GB', 'US')))
+        keys = sorted(tables)
+        time_route('GET /spotify_table 304', services,
+                   lambda i: client.get('/spotify_table', query_string=dict(artist=keys[i % len(keys)][0],
+                                                                           country=keys[i % len(keys)][1]),
+                                        headers={'If-None-Match': '"{0}"'.format(tables[keys[i % len(keys)]])}),
+                   args.requests, 0, status=304)
+        time_route('GET /metrics', services, lambda i: client.get('/metrics'), args.requests, 0)
+        metrics.print_report()
+
+
+if __name__ == '__main__':
+    main()
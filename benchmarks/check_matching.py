@@ -0,0 +1,63 @@
+"""
+Checks TrackResolver's matching on chart entries where a cover or another song of the same name is the easy mistake.
+
+    python benchmarks/check_matching.py
+
+Every search answers with all of an entry's candidates, so each one is offered to every rung of the query ladder,
+the loosest included. Entries expecting None must come back unresolved rather than matched to someone else's
+recording; the rest must pick the right artist.
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from track_resolver import TrackResolver
+
+# (chart song, chart artist, candidates as (name, artists), the artists the match should have, or None for no match)
+CASES = [
+    ('Angel', 'Madonna', [('Angel', ['Shaggy', 'Rayvon'])], None),
+    ('Angel', 'Madonna', [('Angel', ['Shaggy', 'Rayvon']), ('Angel', ['Madonna'])], ['Madonna']),
+    ('Hello', 'Lionel Richie', [('Hello', ['Adele'])], None),
+    ('Hallelujah', 'Alexandra Burke', [('Hallelujah', ['Jeff Buckley']), ('Hallelujah', ['Leonard Cohen'])], None),
+    ('Killing Me Softly', 'Fugees', [('Killing Me Softly With His Song', ['Roberta Flack'])], None),
+    ('I Will Always Love You', 'Whitney Houston', [('I Will Always Love You', ['Dolly Parton'])], None),
+    ('Unchained Melody', 'Gareth Gates', [('Unchained Melody', ['The Righteous Brothers']),
+                                          ('Unchained Melody', ['Gareth Gates'])], ['Gareth Gates']),
+    ('Valerie', 'Mark Ronson ft Amy Winehouse', [('Valerie', ['The Zutons'])], None),
+    ('Valerie', 'Mark Ronson ft Amy Winehouse', [('Valerie', ['The Zutons']),
+                                                 ('Valerie - Version Revisited', ['Mark Ronson', 'Amy Winehouse'])],
+     ['Mark Ronson', 'Amy Winehouse']),
+    ('Especially For You', 'Kylie Minogue & Jason Donovan', [('Especially for You', ['Kylie Minogue', 'Jason Donovan'])],
+     ['Kylie Minogue', 'Jason Donovan']),
+    ('Mockin\' Bird Hill', 'Les Paul And Mary Ford', [('Mockin\' Bird Hill', ['Les Paul', 'Mary Ford'])],
+     ['Les Paul', 'Mary Ford']),
+    ('Hey Jude', 'The Beatles', [('Hey Jude - Remastered 2015', ['The Beatles'])], ['The Beatles']),
+    ('Honeycomb', 'Jimmie Rodgers', [('Honeycomb', ['Jimmy Rodgers'])], ['Jimmy Rodgers']),
+]
+
+
+class CandidateClient(object):
+    def __init__(self, candidates):
+        self.items = [dict(id=str(i), name=name, artists=[dict(name=a) for a in artists], duration_ms=1)
+                      for i, (name, artists) in enumerate(candidates)]
+
+    def search(self, q, limit, type):
+        return dict(tracks=dict(items=self.items[:limit]))
+
+
+def main():
+    failures = []
+    for song, artist, candidates, expected in CASES:
+        info = TrackResolver(CandidateClient(candidates)).resolve(song, artist)
+        found = info['artist'].split(', ') if info else None
+        print('{0:<8}{1} by {2}: {3}'.format('ok' if found == expected else 'WRONG', song, artist,
+                                             info['artist'] if info else 'no match'))
+        if found != expected:
+            failures.append((song, artist))
+    if failures:
+        raise Exception('{0} of {1} entries matched wrongly'.format(len(failures), len(CASES)))
+
+
+if __name__ == '__main__':
+    main()
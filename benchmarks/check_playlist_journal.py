@@ -0,0 +1,111 @@
+"""
+Checks that a playlist built while one of its songs wasn't on Spotify is built again once the song can be found.
+
+    python benchmarks/check_playlist_journal.py
+
+Needs a Postgres server as for bench_pipeline.py, since the generator writes what it resolves back to songbase (into
+the benchmark database; see fixture.py). Each case builds a three song playlist with a journal while the fake
+Spotify is missing the third song, then adds the song and runs the generator again:
+
+  backfilled   the chart rows now carry the song's spotify_info, as after a backfill, so the rows have changed
+  retried      the rows are the same, but the cached miss has expired, so the song is searched for again
+
+and in both the second run must add the song rather than skip the playlist. A run straight after the first, before
+anything has changed, must still skip it.
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHECK_DIR = tempfile.mkdtemp(prefix='songbase-check-')
+os.environ['TRACK_CACHE_PATH'] = os.path.join(CHECK_DIR, 'track_cache.sqlite')  # before caching is imported
+for name in ('SPOTIFY_USERNAME', 'SPOTIFY_CLIENT_ID', 'SPOTIFY_CLIENT_SECRET', 'SPOTIFY_REDIRECT_URI'):
+    os.environ.setdefault(name, 'bench')
+
+import fixture
+from fake_services import FakeServices
+
+fixture.use_bench_database()
+
+import songbase
+import spotify_playlist_generator
+from caching import track_cache
+from playlist_sync import PlaylistJournal, playlist_track_ids
+
+MISS_TTL = 1.0
+CHART = [('Cilla Black', 'Anyone Who Had A Heart'), ('Gene Pitney', 'Twenty Four Hours From Tulsa'),
+         ('Dusty Springfield', 'I Only Want To Be With You')]
+
+
+def track(artist, song):
+    return dict(id=fixture.bench_id('track', song, artist), name=song,
+                artists=[dict(id=fixture.bench_id('artist', artist), name=artist)], duration_ms=180000, popularity=50)
+
+
+class CheckPlaylistGenerator(spotify_playlist_generator.PlaylistGenerator):
+    url = None
+
+    def get_token(self):
+        return 'bench-token'
+
+    def __init__(self, *args, **kwargs):
+        super(CheckPlaylistGenerator, self).__init__(*args, **kwargs)
+        self.sp_client.prefix = self.url + '/v1/'
+
+
+def build(services, name, rows, journal):
+    """
+    runs the generator over rows and returns the number of Spotify calls that changed a playlist, and its tracks.
+    """
+    services.reset_counts()
+    with contextlib.redirect_stdout(io.StringIO()):
+        generator = CheckPlaylistGenerator(name, rows, journal=journal)
+        generator.generate_playlist()
+        songbase.spotify_info_writer.flush()
+        songbase.not_on_spotify_writer.flush()
+    writes = sum(n for endpoint, n in services.calls.items() if endpoint.startswith(('spotify POST', 'spotify PUT',
+                                                                                      'spotify DELETE')))
+    playlist_id = generator.playlists.find(generator.sp_client, name)
+    return writes, playlist_track_ids(generator.sp_client, playlist_id)
+
+
+def check(case, services, journal, known_later):
+    name = 'check: {0}'.format(case)
+    tracks = [track(artist, song) for artist, song in CHART]
+    rows = [(artist, song, None) for artist, song in CHART]
+
+    _, track_ids = build(services, name, rows, journal)
+    if track_ids != [t['id'] for t in tracks[:2]]:
+        raise Exception('{0}: the first run built {1}'.format(case, track_ids))
+    writes, _ = build(services, name, rows, journal)
+    if writes or services.calls['spotify GET search']:
+        raise Exception('{0}: an unchanged playlist was built again straight away'.format(case))
+
+    services.add_tracks(tracks[2:])
+    if known_later:
+        rows = rows[:2] + [(CHART[2][0], CHART[2][1], dict(track_uri=tracks[2]['id'], song=CHART[2][1],
+                                                           artist=CHART[2][0], track_duration=180000))]
+    else:
+        time.sleep(MISS_TTL)
+    _, track_ids = build(services, name, rows, journal)
+    if track_ids != [t['id'] for t in tracks]:
+        raise Exception('{0}: once the song was on Spotify the playlist was left as {1}'.format(case, track_ids))
+    print('ok      {0}: the song was added once it could be found'.format(case))
+
+
+def main():
+    track_cache().miss_ttl = MISS_TTL
+    journal = PlaylistJournal(os.path.join(CHECK_DIR, 'playlist_journal.json'))
+    for case, known_later in (('backfilled', True), ('retried', False)):
+        with FakeServices([track(artist, song) for artist, song in CHART[:2]]) as services:
+            CheckPlaylistGenerator.url = services.url
+            check(case, services, journal, known_later)
+
+
+if __name__ == '__main__':
+    main()
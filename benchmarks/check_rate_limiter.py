@@ -0,0 +1,61 @@
+"""
+Checks that AdaptiveRateLimiter cuts its rate once per throttling episode, not once per 429.
+
+    python benchmarks/check_rate_limiter.py
+
+Several calls are put in flight together and all of them come back with a 429, as they do when Spotify starts
+throttling a pool of workers. The rate must have been cut once; a second 429 after the hold has passed is a new
+episode and cuts it again.
+"""
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import AdaptiveRateLimiter
+
+N_WORKERS = 8
+
+
+class Throttled(Exception):
+    http_status = 429
+    headers = {'Retry-After': '0.2'}
+
+
+def concurrent_429s(limiter, n_workers):
+    """
+    n_workers calls through limiter, each answered with a 429 the first time (once all of them are in flight).
+    """
+    in_flight = threading.Barrier(n_workers)
+    attempts = {}
+
+    def call(worker):
+        attempts[worker] = attempts.get(worker, 0) + 1
+        if attempts[worker] == 1:
+            in_flight.wait()
+            raise Throttled()
+
+    threads = [threading.Thread(target=limiter.call, args=(call, i)) for i in range(n_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    # no increase, so the rate only moves when it's cut; burst so every worker gets a token straight away
+    limiter = AdaptiveRateLimiter(rate=8.0, burst=N_WORKERS, increase=0.0, decrease=0.5)
+    concurrent_429s(limiter, N_WORKERS)
+    if limiter.rate != 4.0:
+        raise Exception('{0} concurrent 429s left the rate at {1}, not 4.0'.format(N_WORKERS, limiter.rate))
+    print('ok      {0} concurrent 429s cut the rate once'.format(N_WORKERS))
+
+    concurrent_429s(limiter, 1)
+    if limiter.rate != 2.0:
+        raise Exception('a 429 after the hold left the rate at {0}, not 2.0'.format(limiter.rate))
+    print('ok      a 429 after the hold is a new episode')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+A local stand-in for the Spotify Web API and Last.fm endpoints this project calls, for benchmarking without a
+network.
+
+FakeServices serves a catalogue of Spotify track objects (see fixture.catalogue) on 127.0.0.1 and implements just
+enough of each endpoint for the project's own calls. Those are track and artist search, artist top tracks, the
+current user's playlists, creating and reading playlists, adding, removing and reordering their tracks, devices and
+play. There is also Last.fm's track.getInfo and a /wiki lookup standing in for Wikipedia.
+
+Every request waits latency seconds (plus up to jitter more). A throttle_rate share of Spotify requests get a 429
+with a Retry-After header instead of an answer. calls counts requests per endpoint, and throttled counts the 429s.
+
+    with FakeServices(fixture.catalogue(songs), latency=0.05, throttle_rate=0.02) as services:
+        sp_client = spotify_client(services.url)
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from fixture import bench_id
+from track_resolver import SpotifyClient
+
+TOKEN = re.compile(r'[0-9a-z]+')
+SEARCH_FIELDS = re.compile(r'\b(artist|track):|\bAND\b')
+ID_PARENTS = ('artists', 'playlists', 'users')  # path segments followed by an id, for naming endpoints
+BENCH_DEVICE_NAME = 'Benchmark Speaker'
+
+
+def tokens(text):
+    return TOKEN.findall(text.lower().replace('\'', ''))
+
+
+def spotify_client(url, **kwargs):
+    """
+    a spotipy client that talks to the fake server instead of api.spotify.com. it's built just as the project's own
+    clients are, retry policy and all, so 429s and retries count the same as they would against Spotify.
+    """
+    sp_client = SpotifyClient(auth='bench-token', **kwargs)
+    sp_client.prefix = url + '/v1/'
+    return sp_client
+
+
+class LastFMClient(object):
+    """
+    get_n_plays, shaped like scraping.lastfm.LastFMHelper's, against the fake server.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.session = requests.Session()
+
+    def get_n_plays(self, track, artist):
+        return self.session.get(self.url + '/2.0/', params=dict(method='track.getInfo', track=track, artist=artist,
+                                                                format='json')).json()
+
+
+class FakeServices(object):
+    def __init__(self, tracks, latency=0.0, jitter=0.0, throttle_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+
+        self.tracks = {}
+        self.artists = {}
+        self.artist_tracks = {}
+        self.index = {}
+        self.playlists = {}
+
+        self.calls = Counter()
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self.add_tracks(tracks)
+
+    def add_tracks(self, tracks):
+        """
+        puts more tracks in the catalogue, as when Spotify gets a song it didn't have.
+        """
+        with self._lock:
+            for track in tracks:
+                self.tracks[track['id']] = track
+                for artist in track['artists']:
+                    self.artists[artist['id']] = artist
+                    self.artist_tracks.setdefault(artist['id'], []).append(track)
+                for token in set(tokens(track['name']) + tokens(' '.join(a['name'] for a in track['artists']))):
+                    self.index.setdefault(token, set()).add(track['id'])
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self._server.server_address)
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._server.services = self
+        threading.Thread(target=self._server.serve_forever, name='fake-services', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled = 0
+
+    def api_calls(self, prefix='spotify'):
+        return sum(n for endpoint, n in self.calls.items() if endpoint.startswith(prefix))
+
+    def should_throttle(self):
+        with self._lock:
+            throttle = self.rng.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+            return throttle
+
+    def delay(self):
+        with self._lock:
+            extra = self.rng.uniform(0, self.jitter) if self.jitter else 0
+        time.sleep(self.latency + extra)
+
+    def count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    # spotify
+
+    def search_tracks(self, q, limit):
+        wanted = tokens(SEARCH_FIELDS.sub(' ', q))
+        hits = Counter()
+        for token in wanted:
+            for track_id in self.index.get(token, ()):
+                hits[track_id] += 1
+        best = sorted(hits.items(), key=lambda hit: (-hit[1], hit[0]))[:limit]
+        return [self.tracks[track_id] for track_id, _ in best]
+
+    def search(self, params):
+        q, limit = params['q'], int(params.get('limit', 10))
+        if params.get('type') == 'artist':
+            matches = self.search_tracks(q, 50)
+            artists = []
+            for track in matches:
+                for artist in track['artists']:
+                    if artist not in artists:
+                        artists.append(artist)
+            return dict(artists=dict(items=artists[:limit]))
+        return dict(tracks=dict(items=self.search_tracks(q, limit)))
+
+    def page(self, path, items, params):
+        limit, offset = int(params.get('limit', 20)), int(params.get('offset', 0))
+        more = offset + limit < len(items)
+        return dict(items=items[offset:offset + limit],
+                    total=len(items),
+                    next='{0}{1}?limit={2}&offset={3}'.format(self.url, path, limit, offset + limit) if more else None)
+
+    def playlist_summary(self, playlist):
+        return dict(id=playlist['id'], name=playlist['name'], snapshot_id=str(playlist['version']))
+
+    def new_playlist(self, name):
+        with self._lock:
+            playlist_id = bench_id('playlist', name, str(len(self.playlists)))
+            self.playlists[playlist_id] = dict(id=playlist_id, name=name, version=0, track_ids=[])
+        return self.playlist_summary(self.playlists[playlist_id])
+
+    def edit_playlist(self, playlist_id, add=(), remove=(), position=None, move=None):
+        """
+        adds (at position, or on the end), removes, or moves (range_start, insert_before, range_length) tracks.
+        """
+        with self._lock:
+            playlist = self.playlists[playlist_id]
+            track_ids = [i for i in playlist['track_ids'] if i not in set(remove)]
+            if position is None:
+                position = len(track_ids)
+            track_ids[position:position] = add
+            if move:
+                start, before, length = move
+                moving = track_ids[start:start + length]
+                del track_ids[start:start + length]
+                before = before if before <= start else before - length
+                track_ids[before:before] = moving
+            playlist['track_ids'] = track_ids
+            playlist['version'] += 1
+            return dict(snapshot_id=str(playlist['version']))
+
+    # last.fm
+
+    def track_info(self, params):
+        for track in self.search_tracks('{0} {1}'.format(params.get('track', ''), params.get('artist', '')), 1):
+            return dict(track=dict(name=track['name'],
+                                   artist=dict(name=track['artists'][0]['name']),
+                                   playcount=str(track['popularity'] * 10007),
+                                   listeners=str(track['popularity'] * 1009)))
+        return dict(error=6, message='Track not found')
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as requests would get from the real APIs
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body=None, headers=()):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def handle_request(self, method):
+        services = self.server.services
+        url = urlparse(self.path)
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        path = url.path.rstrip('/')
+        body = self.body()
+        services.delay()
+
+        if path == '/2.0':
+            services.count('lastfm track.getInfo')
+            return self.send_json(200, services.track_info(params))
+        if path == '/wiki':
+            services.count('wiki page')
+            return self.send_json(200, dict(url='https://en.wikipedia.org/wiki/' +
+                                                '_'.join(params.get('song', '').split())))
+        if not path.startswith('/v1/'):
+            return self.send_json(404, dict(error=dict(status=404, message='not found')))
+
+        parts = path[len('/v1/'):].split('/')
+        endpoint = 'spotify {0} {1}'.format(method, '/'.join('{id}' if i and parts[i - 1] in ID_PARENTS else p
+                                                             for i, p in enumerate(parts)))
+        services.count(endpoint)
+        if services.should_throttle():
+            return self.send_json(429, dict(error=dict(status=429, message='API rate limit exceeded')),
+                                  headers=[('Retry-After', str(services.retry_after))])
+
+        if parts == ['search']:
+            return self.send_json(200, services.search(params))
+        if parts[0] == 'artists' and parts[2:] == ['top-tracks']:
+            tracks = sorted(services.artist_tracks.get(parts[1], []), key=lambda t: -t['popularity'])[:10]
+            return self.send_json(200, dict(tracks=tracks))
+        if parts == ['me', 'playlists']:
+            playlists = [services.playlist_summary(p) for p in services.playlists.values()]
+            return self.send_json(200, services.page(path, playlists, params))
+        if parts[0] == 'users' and parts[2:] == ['playlists'] and method == 'POST':
+            return self.send_json(201, services.new_playlist(body['name']))
+        if parts[0] == 'playlists' and parts[1] not in services.playlists:
+            return self.send_json(404, dict(error=dict(status=404, message='Invalid playlist Id')))
+        if parts[0] == 'playlists' and len(parts) == 2:
+            return self.send_json(200, services.playlist_summary(services.playlists[parts[1]]))
+        if parts[0] == 'playlists' and parts[2:] in (['tracks'], ['items']):
+            if method == 'GET':
+                items = [dict(track=dict(id=i)) for i in services.playlists[parts[1]]['track_ids']]
+                return self.send_json(200, services.page(path, items, params))
+            if method == 'POST':
+                uris = body['uris'] if isinstance(body, dict) else body
+                position = int(params['position']) if 'position' in params else None
+                return self.send_json(201, services.edit_playlist(parts[1], add=[u.split(':')[-1] for u in uris],
+                                                                  position=position))
+            if method == 'PUT':
+                move = (body['range_start'], body['insert_before'], body.get('range_length', 1))
+                return self.send_json(200, services.edit_playlist(parts[1], move=move))
+            if method == 'DELETE':
+                items = body.get('items') or body.get('tracks')
+                return self.send_json(200, services.edit_playlist(parts[1],
+                                                                  remove=[i['uri'].split(':')[-1] for i in items]))
+        if parts == ['me', 'player', 'devices']:
+            return self.send_json(200, dict(devices=[dict(id='benchdevice', name=BENCH_DEVICE_NAME, is_active=True)]))
+        if parts == ['me', 'player', 'play']:
+            return self.send_json(204)
+        return self.send_json(404, dict(error=dict(status=404, message='not found')))
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
@@ -0,0 +1,180 @@
+"""
+Seeded, synthetic chart data for the benchmarks.
+
+chart_songs() makes the same songs for the same seed every time. Their names carry the clutter the cleaners deal
+with, like "feat." credits, bracketed suffixes, "The" and trailing punctuation. catalogue() is the Spotify side of
+the same songs: clean names, the odd " - Remastered" suffix, and no track at all for a share of them, so searches
+miss as they would for real.
+
+seed_songbase() writes the songs into a dedicated benchmark database, BENCH_DB_NAME (default songbase_bench), and
+never anywhere else. It creates weekly_charts, songs_not_on_spotify and a song_peaks_mv stand-in in the songbase
+schema there, plus the unique indexes from sql/. use_bench_database() points songbase at that database; call it
+before anything connects. Since the songbase schema is dropped first, both refuse a BENCH_DB_NAME that doesn't end in
+_bench or that is the DB_NAME songbase was configured with.
+"""
+import datetime
+import hashlib
+import os
+import random
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+BENCH_SEED = 1952
+BENCH_DB_NAME = os.environ.get('BENCH_DB_NAME', 'songbase_bench')
+SONGBASE_DB_NAME = os.environ.get('DB_NAME')  # before use_bench_database() replaces it
+SQL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sql')
+
+WORDS = ['love', 'heart', 'baby', 'night', 'dance', 'blue', 'moon', 'rain', 'fire', 'summer', 'dream', 'river',
+         'girl', 'boy', 'home', 'light', 'tonight', 'forever', 'kiss', 'angel', 'wild', 'sweet', 'golden', 'lonely',
+         'crazy', 'runaway', 'sunshine', 'paradise', 'magic', 'honey', 'diamond', 'thunder', 'shadow', 'silver',
+         'rhythm', 'world', 'tears', 'stars', 'ocean', 'highway', 'midnight', 'rose', 'soul', 'city', 'train',
+         'radio', 'wonder', 'memory', 'echo', 'velvet', 'electric', 'sugar', 'storm', 'garden', 'winter', 'desire',
+         'fever', 'mirror', 'window', 'stranger', 'mountain', 'island', 'candle', 'whisper', 'freedom', 'yesterday']
+FIRST_NAMES = ['Frankie', 'Cliff', 'Dusty', 'Marvin', 'Aretha', 'Elton', 'Kylie', 'Jimmie', 'Lulu', 'Shirley', 'Tom',
+               'Petula', 'Billy', 'Cilla', 'Gene', 'Bobby', 'Sandie', 'Adam', 'Paul', 'Rita', 'Nat', 'Connie']
+LAST_NAMES = ['Laine', 'Richard', 'Springfield', 'Gaye', 'Franklin', 'John', 'Minogue', 'Rodgers', 'Bassey', 'Jones',
+              'Clark', 'Fury', 'Black', 'Pitney', 'Shaw', 'Faith', 'Anka', 'Ora', 'Cole', 'Francis', 'Vee', 'Day']
+SONG_CLUTTER = ['', '', '', '', ' (Live)', '!', ' [Remix]', '...', ' {Single Version}', '?']
+VERSION_SUFFIXES = ['', '', '', '', ' - Remastered', ' - Single Version', ' - Mono']
+
+
+def bench_id(*parts):
+    """
+    a stable base62-safe id for the fake Spotify objects.
+    """
+    return hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()[:22]
+
+
+def chart_songs(seed=BENCH_SEED, n_songs=6000, year_start=1952, year_end=2021, miss_rate=0.08):
+    """
+    [dict(song, artist, year, peak, weeks, on_spotify, spotify_song, spotify_artist)], the same for the same arguments.
+    """
+    rng = random.Random(seed)
+    artists = []
+    for _ in range(n_songs // 4):
+        if rng.random() < 0.3:
+            name = 'The {0} {1}s'.format(rng.choice(WORDS).title(), rng.choice(WORDS).title())
+        else:
+            name = '{0} {1}'.format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        artists.append(name)
+    artists = sorted(set(artists))
+
+    songs = {}
+    while len(songs) < n_songs:
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+        artist = rng.choice(artists)
+        if (title, artist) in songs:
+            continue
+        featuring = rng.choice(artists) if rng.random() < 0.1 else None
+        songs[title, artist] = dict(
+            song=title + rng.choice(SONG_CLUTTER),
+            artist=artist + (' feat. ' + featuring if featuring else ''),
+            year=rng.randint(year_start, year_end),
+            peak=rng.randint(1, 40),
+            weeks=rng.randint(1, 10),
+            on_spotify=rng.random() >= miss_rate,
+            spotify_song=title + rng.choice(VERSION_SUFFIXES),
+            spotify_artist=artist if not featuring else artist + ', ' + featuring)
+    return list(songs.values())
+
+
+def catalogue(songs):
+    """
+    Spotify track objects for the songs that are on Spotify.
+    """
+    tracks = []
+    for song in songs:
+        if not song['on_spotify']:
+            continue
+        tracks.append(dict(id=bench_id('track', song['spotify_song'], song['spotify_artist']),
+                           name=song['spotify_song'],
+                           artists=[dict(id=bench_id('artist', name), name=name)
+                                    for name in song['spotify_artist'].split(', ')],
+                           duration_ms=120000 + len(song['spotify_song']) * 1000,
+                           popularity=100 - song['peak']))
+    return tracks
+
+
+def chart_rows(song):
+    """
+    weekly_charts rows (week_start_date, position, song, artist) for one song: in at a random week of its year,
+    up to its peak, then falling.
+    """
+    rng = random.Random(song['song'] + song['artist'])
+    week = datetime.date(song['year'], 1, 1) + datetime.timedelta(weeks=rng.randint(0, 51))
+    positions = sorted(rng.randint(song['peak'], 75) for _ in range(song['weeks'] - 1))
+    positions = positions[::-1][:len(positions) // 2] + [song['peak']] + positions[len(positions) // 2:]
+    return [(week + datetime.timedelta(weeks=i), position, song['song'], song['artist'])
+            for i, position in enumerate(positions)]
+
+
+def connect(dbname=BENCH_DB_NAME):
+    kwargs = dict(dbname=dbname,
+                  user=os.environ.get('DB_USER'),
+                  host=os.environ.get('DB_HOST'),
+                  port=os.environ.get('DB_PORT'),
+                  password=os.environ.get('DB_PASSWORD'))
+    return psycopg2.connect(**dict((k, v) for k, v in kwargs.items() if v))
+
+
+def check_bench_database_name():
+    if not BENCH_DB_NAME.endswith('_bench') or BENCH_DB_NAME == SONGBASE_DB_NAME:
+        raise RuntimeError('refusing to use {0} as the benchmark database: its songbase schema would be dropped. '
+                           'BENCH_DB_NAME must end in _bench and not be DB_NAME'.format(BENCH_DB_NAME))
+
+
+def use_bench_database():
+    """
+    creates BENCH_DB_NAME if it doesn't exist and points songbase at it.
+    """
+    check_bench_database_name()
+    conn = connect(dbname='postgres')
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('SELECT 1 FROM pg_database WHERE datname = %s', (BENCH_DB_NAME,))
+        if not cur.fetchone():
+            cur.execute('CREATE DATABASE {0}'.format(BENCH_DB_NAME))
+    conn.close()
+    os.environ['DB_NAME'] = BENCH_DB_NAME
+
+
+def seed_songbase(songs):
+    """
+    (re)creates the songbase schema in the benchmark database from songs. returns the number of chart rows.
+    """
+    check_bench_database_name()
+    rows = [row for song in songs for row in chart_rows(song)]
+    conn = connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            DROP SCHEMA IF EXISTS songbase CASCADE;
+            CREATE SCHEMA songbase;
+            CREATE TABLE songbase.weekly_charts (
+                id SERIAL PRIMARY KEY,
+                week_start_date DATE NOT NULL,
+                position INT NOT NULL,
+                song TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                spotify_track_uri TEXT,
+                spotify_song TEXT,
+                spotify_artist TEXT,
+                spotify_track_duration INT);
+            CREATE INDEX ON songbase.weekly_charts (song, artist);
+            CREATE TABLE songbase.songs_not_on_spotify (song TEXT, artist TEXT);""")
+        execute_values(cur, """
+            INSERT INTO songbase.weekly_charts (week_start_date, position, song, artist)
+            VALUES %s""", rows, page_size=5000)
+        cur.execute("""
+            CREATE MATERIALIZED VIEW songbase.song_peaks_mv AS
+            SELECT
+                song, artist, MIN(position) AS chart_peak, MIN(week_start_date) AS week_start_date,
+                MAX(spotify_track_uri) AS spotify_track_uri, MAX(spotify_song) AS spotify_song,
+                MAX(spotify_artist) AS spotify_artist, MAX(spotify_track_duration) AS spotify_track_duration
+            FROM songbase.weekly_charts
+            GROUP BY song, artist;""")
+        for name in sorted(i for i in os.listdir(SQL_DIR) if i.endswith('.sql')):
+            with open(os.path.join(SQL_DIR, name)) as f:
+                cur.execute(f.read())
+    conn.close()
+    return len(rows)
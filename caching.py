@@ -0,0 +1,212 @@
+"""
+Small caches shared by the batch generators and the Flask app.
+
+LRUCache is an in-process, size bounded cache with per entry expiry. SqliteCache keeps the same kind of entries on
+disk so they survive reruns and restarts. TrackCache puts the two together for (song, artist) -> Spotify track
+lookups, remembering songs that aren't on Spotify for a shorter time than ones that are. SingleFlight covers the gap
+a cache can't: callers asking for the same key while its value is still being fetched.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+NOT_CACHED = object()  # returned by get() when there is no live entry; None is a perfectly good cached value
+
+DAY = 24 * 60 * 60
+DEFAULT_CACHE_PATH = os.environ.get('TRACK_CACHE_PATH',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'track_cache.sqlite'))
+
+
+def expiry(ttl):
+    return time.time() + ttl if ttl is not None else None
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=NOT_CACHED):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        self.put(key, value, expiry(ttl if ttl is not None else self.ttl))
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteCache(object):
+    """
+    key/value cache in a SQLite file. keys and values must be JSON serialisable.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, table='cache'):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS {0} (
+                                      key TEXT PRIMARY KEY,
+                                      value TEXT,
+                                      expires_at REAL
+                                  )""".format(table))
+
+    def get_entry(self, key):
+        """
+        returns (value, expires_at) for a live entry, otherwise None.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires_at FROM {0} WHERE key = ?'.format(self.table),
+                                     (json.dumps(key),)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0]), row[1]
+
+    def get(self, key, default=NOT_CACHED):
+        entry = self.get_entry(key)
+        return entry[0] if entry else default
+
+    def put(self, key, value, expires_at):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO {0} (key, value, expires_at) VALUES (?, ?, ?)'.format(self.table),
+                               (json.dumps(key), json.dumps(value), expires_at))
+
+    def set(self, key, value, ttl=None):
+        self.put(key, value, expiry(ttl))
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM {0} WHERE key = ?'.format(self.table), (json.dumps(key),))
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM {0} WHERE expires_at < ?'.format(self.table), (time.time(),))
+
+
+class TieredCache(object):
+    """
+    an LRUCache in front of a persistent store (a SqliteCache unless told otherwise).
+    """
+    def __init__(self, store, lru_size=4096):
+        self.store = store
+        self.lru = LRUCache(maxsize=lru_size)
+
+    def get(self, key, default=NOT_CACHED):
+        value = self.lru.get(key)
+        if value is not NOT_CACHED:
+            return value
+        entry = self.store.get_entry(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        self.lru.put(key, value, expires_at)
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = expiry(ttl)
+        self.store.put(key, value, expires_at)
+        self.lru.put(key, value, expires_at)
+
+    def delete(self, key):
+        self.lru.delete(key)
+        self.store.delete(key)
+
+
+class TrackCache(object):
+    """
+    cleaned (song, artist) -> track_info dict, or None for songs we know aren't on Spotify.
+    """
+    def __init__(self, store=None, ttl=30 * DAY, miss_ttl=3 * DAY, lru_size=4096):
+        self.cache = TieredCache(store or SqliteCache(table='spotify_tracks'), lru_size=lru_size)
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+
+    def get(self, song, artist):
+        return self.cache.get((song, artist))
+
+    def set(self, song, artist, info):
+        self.cache.set((song, artist), info, ttl=self.ttl if info else self.miss_ttl)
+
+
+class SingleFlight(object):
+    """
+    lets concurrent callers asking for the same key share one call: the first runs func and the rest wait for its
+    result (or its exception) instead of making the same call again.
+    """
+    def __init__(self):
+        self.calls = 0  # calls actually made
+        self.shared = 0  # callers who waited on someone else's call instead
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        returns (func(*args, **kwargs), shared), shared being True if another caller made the call.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return flight.result(), True
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+
+_track_cache = None
+_track_cache_lock = threading.Lock()
+
+
+def track_cache():
+    """
+    the process wide TrackCache.
+    """
+    global _track_cache
+    with _track_cache_lock:
+        if _track_cache is None:
+            _track_cache = TrackCache()
+        return _track_cache
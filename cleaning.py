@@ -0,0 +1,86 @@
+"""
+Normalises chart song and artist names into something Spotify's search will match.
+
+The rules are the ones the playlist generator has always used, compiled once at import time and applied in a single
+pass per string, with results memoised because the same songs turn up over and over across years and peaks. Use
+clean_song() / clean_artist() for one value and clean_many() for a whole query result.
+
+issues noticed
+  - numbers (e.g. 99 ways vs. ninety-nine ways) -- possibly use the inflect library https://stackoverflow.com/questions/8982163/how-do-i-tell-python-to-convert-integers-into-words
+  - americanisms (paralyzed vs. paralysed) -- dunno, maybe a python lib?
+  - misspellings (jimmie rodgers vs. jimmy rodgers) - dunno..
+  - spotify apostrophes (where they have an apostrophe in their name, but we don't, e.g. Mocking Bird Hill vs. Mockin' Bird Hill) - dunno..
+"""
+import re
+from functools import lru_cache
+
+BRACKETS = ('{}', '[]', '()')
+FEAT_KEYWORDS = (' ft ', ' feat ', ' featuring ', ' ft. ', ' feat. ')  # must have space separation
+SYMBOLS_TO_CUT_OFF_AFTER = ('!', ',', '...', '?', '(', '{', '[')
+MULTIPLE_SEPARATORS = ('/', '&')
+EXTRA_CREDITS = (' with ', ' and ', ' starring ', ' - ')  # spaces important, e.g. Andy Williams
+CACHE_SIZE = 65536
+
+
+def _cut_before_first_of(keywords):
+    """
+    matches everything before the first occurrence of the earliest listed keyword that appears at all, i.e. keywords
+    are tried in priority order rather than by position in the string.
+    """
+    return re.compile('|'.join('(.*?){0}'.format(re.escape(k)) for k in keywords), re.DOTALL)
+
+
+FEATURING = _cut_before_first_of(FEAT_KEYWORDS)
+SYMBOLS = _cut_before_first_of(SYMBOLS_TO_CUT_OFF_AFTER)
+MULTIPLES = re.compile('|'.join(re.escape(s) for s in MULTIPLE_SEPARATORS))
+
+
+def _cut(pattern, text):
+    match = pattern.match(text)
+    return match.group(match.lastindex) if match else text
+
+
+def _remove_brackets(text):
+    for opening, closing in BRACKETS:
+        start = text.find(opening)
+        if start != -1:
+            end = text.find(closing)
+            if end != -1:
+                text = text[:start] + text[end + 1:]
+    return text
+
+
+def _remove_extra_credits(text):
+    for con in EXTRA_CREDITS:
+        text = text.split(con, 1)[0].strip()
+    return text
+
+
+def _remove_the(text):
+    if text.strip().startswith('the '):
+        return text[len('the'):].strip()
+    return text
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def clean_song(song):
+    text = _remove_brackets(song.lower())  # do this first
+    text = _cut(FEATURING, text)
+    text = MULTIPLES.split(text, 1)[0].replace('\'', '')
+    return _cut(SYMBOLS, text).strip()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def clean_artist(artist):
+    text = _remove_brackets(artist.lower())  # do this first
+    text = _remove_extra_credits(_cut(FEATURING, text))
+    text = MULTIPLES.split(_cut(SYMBOLS, text), 1)[0].replace('\'', '')
+    return _remove_the(text).strip()
+
+
+def clean_many(rows, song_index=1, artist_index=0):
+    """
+    cleans a whole query result. by default rows are (artist, song, ...) as returned by the songbase queries.
+    returns a list of (clean_song, clean_artist) tuples in row order.
+    """
+    return [(clean_song(row[song_index]), clean_artist(row[artist_index])) for row in rows]
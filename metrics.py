@@ -0,0 +1,295 @@
+"""
+Counters and latency histograms for the calls that cost time: Spotify, Last.fm, Wikipedia, gspread and songbase,
+plus cache hit ratios and how long each pipeline stage spends per item.
+
+Everything goes into one process wide registry. The Flask app serves it at /metrics in Prometheus' text format
+(prometheus_text()) and the batch generators print summary() when they finish. With profile_stages() switched on,
+every pipeline stage also runs under its own cProfile profile, and print_profiles() prints one report per stage.
+
+    with timed('lastfm', 'get_n_plays'):
+        ...
+
+    @instrument('songbase')
+    def fetch_songs(...):
+        ...
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TOO_MANY_REQUESTS = 429
+
+# the spotipy methods the project calls; wrapping these (rather than spotipy's internals) counts each call once
+SPOTIFY_METHODS = ('search', 'next', 'artist_top_tracks', 'current_user_playlists', 'user_playlist_create',
+                   'playlist', 'playlist_items', 'user_playlist_add_tracks',
+                   'user_playlist_remove_all_occurrences_of_tracks', 'playlist_reorder_items', 'devices',
+                   'start_playback')
+
+HELP = {
+    'api_calls_total': ('counter', 'Calls made to an external service or the database.'),
+    'api_errors_total': ('counter', 'Calls that raised.'),
+    'api_throttled_total': ('counter', 'Calls answered with HTTP 429.'),
+    'api_retries_total': ('counter', 'Calls retried after being rate limited.'),
+    'api_calls_saved_total': ('counter', 'Calls not made because the same lookup was already in flight.'),
+    'api_call_seconds': ('histogram', 'Time spent in each call.'),
+    'cache_requests_total': ('counter', 'Cache lookups, by result.'),
+    'cache_hit_ratio': ('gauge', 'Share of cache lookups that were hits.'),
+    'stage_seconds': ('histogram', 'Time spent on one item in a pipeline stage.'),
+}
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            self.counts[i] += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            yield bound, total
+
+
+class Registry(object):
+    def __init__(self):
+        self.counters = defaultdict(int)  # (name, labels) -> value; labels is a sorted tuple of (key, value)
+        self.histograms = {}
+        self.profiles = defaultdict(list)
+        self.profiling = False
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self.counters[name, tuple(sorted(labels.items()))] += amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.profiles.clear()
+
+
+_registry = Registry()
+
+
+def inc(name, amount=1, **labels):
+    _registry.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    _registry.observe(name, value, **labels)
+
+
+def reset():
+    _registry.reset()
+
+
+@contextmanager
+def timed(service, call):
+    """
+    counts and times the call, and counts it as an error (and a 429, if it was one) if it raises.
+    """
+    inc('api_calls_total', service=service, call=call)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        inc('api_errors_total', service=service, call=call)
+        if getattr(e, 'http_status', None) == TOO_MANY_REQUESTS:
+            inc('api_throttled_total', service=service)
+        raise
+    finally:
+        observe('api_call_seconds', time.perf_counter() - start, service=service, call=call)
+
+
+def instrument(service, call=None):
+    """
+    decorator version of timed(); call defaults to the function's name.
+    """
+    def decorator(func):
+        name = call or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(service, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_methods(obj, service, methods):
+    """
+    replaces each of methods on obj (the instance, not its class) with a timed version. returns obj.
+    """
+    for method in methods:
+        setattr(obj, method, instrument(service, method)(getattr(obj, method)))
+    return obj
+
+
+def instrument_spotify(sp_client):
+    return instrument_methods(sp_client, 'spotify', SPOTIFY_METHODS)
+
+
+def cache_lookup(cache, hit):
+    inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+@contextmanager
+def stage(name):
+    """
+    times one item through a pipeline stage, under cProfile too if profile_stages() is on.
+    """
+    profile = cProfile.Profile() if _registry.profiling else None
+    if profile is not None:
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is already active (python -m cProfile, or another thread on 3.12+)
+            profile = None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if profile is not None:
+            profile.disable()
+            with _registry._lock:
+                _registry.profiles[name].append(profile)
+        observe('stage_seconds', elapsed, stage=name)
+
+
+def profile_stages(enabled=True):
+    _registry.profiling = enabled
+
+
+def print_profiles(sort='cumulative', limit=20):
+    for name, profiles in sorted(_registry.profiles.items()):
+        out = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=out)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.sort_stats(sort).print_stats(limit)
+        print('=============== {0} stage profile ({1} items) ==============='.format(name, len(profiles)))
+        print(out.getvalue())
+
+
+def _labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+def cache_ratios():
+    """
+    {cache: (hits, lookups)}
+    """
+    ratios = defaultdict(lambda: [0, 0])
+    with _registry._lock:
+        counters = list(_registry.counters.items())
+    for (name, labels), value in counters:
+        if name == 'cache_requests_total':
+            labels = dict(labels)
+            ratios[labels['cache']][1] += value
+            if labels['result'] == 'hit':
+                ratios[labels['cache']][0] += value
+    return dict((cache, tuple(counts)) for cache, counts in ratios.items())
+
+
+def prometheus_text():
+    """
+    everything in the registry, in Prometheus' text exposition format.
+    """
+    with _registry._lock:
+        counters = sorted(_registry.counters.items())
+        histograms = sorted((key, (list(h.cumulative()), h.count, h.sum)) for key, h in _registry.histograms.items())
+    lines = []
+    seen = set()
+
+    def header(name):
+        if name not in seen:
+            seen.add(name)
+            kind, text = HELP.get(name, ('untyped', name))
+            lines.append('# HELP {0} {1}'.format(name, text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+
+    for (name, labels), value in counters:
+        header(name)
+        lines.append('{0}{1} {2}'.format(name, _labels(labels), value))
+    for cache, (hits, lookups) in sorted(cache_ratios().items()):
+        header('cache_hit_ratio')
+        lines.append('cache_hit_ratio{0} {1}'.format(_labels([('cache', cache)]), hits / lookups if lookups else 0))
+    for (name, labels), (buckets, count, total) in histograms:
+        header(name)
+        for bound, n in buckets:
+            lines.append('{0}_bucket{1} {2}'.format(name, _labels(labels, [('le', bound)]), n))
+        lines.append('{0}_bucket{1} {2}'.format(name, _labels(labels, [('le', '+Inf')]), count))
+        lines.append('{0}_sum{1} {2}'.format(name, _labels(labels), total))
+        lines.append('{0}_count{1} {2}'.format(name, _labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """
+    a plain text table of time per pipeline stage and per call, with cache hit ratios, for the end of a batch run.
+    """
+    with _registry._lock:
+        histograms = sorted((key, h.count, h.sum) for key, h in _registry.histograms.items())
+        errors = dict(_registry.counters)
+    rows = []
+    for (name, labels), count, total in histograms:
+        labels = dict(labels)
+        if name == 'stage_seconds':
+            label, n_errors = 'stage ' + labels['stage'], ''
+        else:
+            label = '{0} {1}'.format(labels['service'], labels['call'])
+            n_errors = errors.get(('api_errors_total', tuple(sorted(labels.items()))), 0)
+        rows.append((name != 'stage_seconds', label, count, total, n_errors))
+    lines = ['{0:<48}{1:>10}{2:>12}{3:>12}{4:>8}'.format('', 'count', 'total s', 'mean ms', 'errors')]
+    for _, label, count, total, n_errors in sorted(rows):
+        lines.append('{0:<48}{1:>10,}{2:>12.2f}{3:>12.1f}{4:>8}'.format(label, count, total,
+                                                                      1000 * total / count, n_errors))
+    for (name, labels), value in sorted(errors.items()):
+        if name in ('api_throttled_total', 'api_retries_total', 'api_calls_saved_total'):
+            lines.append('{0:<48}{1:>10,}'.format('{0} {1}'.format(dict(labels)['service'], name[4:-6]), value))
+    for cache, (hits, lookups) in sorted(cache_ratios().items()):
+        lines.append('{0:<48}{1:>10,}{2:>12}'.format('cache ' + cache, lookups,
+                                                     '{0:.0%} hits'.format(hits / lookups if lookups else 0)))
+    return '\n'.join(lines)
+
+
+def add_profile_argument(parser):
+    parser.add_argument('--profile', action='store_true', help='run each pipeline stage under cProfile')
+
+
+def print_report(profile=False):
+    """
+    what the batch generators print when they finish: the summary, then the stage profiles if --profile was given.
+    """
+    print('=============== Timings ===============')
+    print(summary())
+    if profile:
+        print_profiles()
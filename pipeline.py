@@ -0,0 +1,120 @@
+"""
+Small streaming pipelines for the batch tools and the Flask app.
+
+A Pipeline runs items through a chain of Stages. Each stage is a plain one-in, one-out function with its own number of
+worker threads, and stages are joined by queues, so a fast stage (cleaning) and a slow one (searching Spotify) run
+side by side instead of in turn. At most max_in_flight items are between the source and the consumer at any time:
+once that many are waiting, the source isn't read again until the consumer takes one, so a slow stage holds back the
+database rather than letting memory grow.
+
+Results come out in the order the items went in. If a stage raises, the exception is raised to the consumer when the
+failed item's turn comes, and the rest of the run is abandoned.
+"""
+import queue
+import threading
+
+import metrics
+
+DONE = object()
+
+
+class Failed(object):
+    def __init__(self, error):
+        self.error = error
+
+
+class Stage(object):
+    def __init__(self, func, workers=1, name=None):
+        self.func = func
+        self.workers = workers
+        self.name = name or getattr(func, '__name__', 'stage')
+
+
+class Pipeline(object):
+    def __init__(self, *stages, max_in_flight=None):
+        self.stages = stages
+        self.max_in_flight = max_in_flight or 4 * sum(stage.workers for stage in stages)
+
+    def _feed(self, items, inbox, in_flight, stopped, n_workers):
+        seq = 0
+        items = iter(items)
+        try:
+            while True:
+                while not in_flight.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        return
+                if stopped.is_set():
+                    return
+                try:
+                    item = next(items)
+                except StopIteration:
+                    in_flight.release()
+                    return
+                except Exception as e:
+                    item = Failed(e)
+                inbox.put((seq, item))
+                seq += 1
+                if isinstance(item, Failed):
+                    return
+        finally:
+            for _ in range(n_workers):
+                inbox.put(DONE)
+
+    @staticmethod
+    def _work(stage, inbox, outbox, stopped, finished, next_workers):
+        while True:
+            entry = inbox.get()
+            if entry is DONE:
+                break
+            seq, item = entry
+            if not isinstance(item, Failed) and not stopped.is_set():
+                try:
+                    with metrics.stage(stage.name):
+                        item = stage.func(item)
+                except Exception as e:
+                    item = Failed(e)
+            outbox.put((seq, item))
+        with finished[1]:
+            finished[0] -= 1
+            last = finished[0] == 0
+        if last:  # every worker on this stage is done, so the next one can stop too
+            for _ in range(next_workers):
+                outbox.put(DONE)
+
+    def run(self, items):
+        """
+        a generator of func(...(func(item))) for each of items, in order.
+        """
+        stopped = threading.Event()
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        queues = [queue.Queue(maxsize=self.max_in_flight + stage.workers) for stage in self.stages]
+        results = queue.Queue()
+        outboxes = queues[1:] + [results]
+
+        threading.Thread(target=self._feed, args=(items, queues[0], in_flight, stopped, self.stages[0].workers),
+                         name='pipeline-source', daemon=True).start()
+        for i, stage in enumerate(self.stages):
+            next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            finished = [stage.workers, threading.Lock()]
+            for n in range(stage.workers):
+                threading.Thread(target=self._work,
+                                 args=(stage, queues[i], outboxes[i], stopped, finished, next_workers),
+                                 name='pipeline-{0}-{1}'.format(stage.name, n), daemon=True).start()
+
+        pending = {}
+        next_seq = 0
+        try:
+            while True:
+                while next_seq in pending:
+                    item = pending.pop(next_seq)
+                    next_seq += 1
+                    in_flight.release()
+                    if isinstance(item, Failed):
+                        raise item.error
+                    yield item
+                entry = results.get()
+                if entry is DONE:
+                    return
+                pending[entry[0]] = entry[1]
+        finally:
+            stopped.set()
@@ -0,0 +1,69 @@
+"""
+Name -> id index of the current user's Spotify playlists.
+
+current_user_playlists() is paged (PLAYLIST_PAGE_SIZE at a time), so the index pages through all of them once, the
+first time a name is looked up, and after that answers lookups from memory. Playlists created through the index are
+added to it from user_playlist_create's response, so a run that creates hundreds of playlists never has to list them
+again. If two playlists share a name the first one Spotify lists wins, as it always has.
+
+The index outlives any one client (the generators build a new one, with a fresh token, for every playlist), so each
+call takes the client to make its Spotify calls with rather than keeping the one it was first built with.
+"""
+import threading
+
+PLAYLIST_PAGE_SIZE = 50  # the most current_user_playlists will return per call
+
+
+class PlaylistIndex(object):
+    def __init__(self, username):
+        self.username = username
+        self._ids = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load(sp_client):
+        ids = {}
+        page = sp_client.current_user_playlists(limit=PLAYLIST_PAGE_SIZE)
+        while page:
+            for playlist in page['items']:
+                ids.setdefault(playlist['name'], str(playlist['id']))
+            page = sp_client.next(page) if page['next'] else None
+        return ids
+
+    def reload(self, sp_client):
+        ids = self._load(sp_client)
+        with self._lock:
+            self._ids = ids
+
+    def find(self, sp_client, name):
+        """
+        the id of the playlist called name, or None if there isn't one.
+        """
+        if self._ids is None:
+            self.reload(sp_client)
+        return self._ids.get(name)
+
+    def create(self, sp_client, name, public=True):
+        playlist = sp_client.user_playlist_create(self.username, name, public=public)
+        if self._ids is None:
+            self.reload(sp_client)
+        with self._lock:
+            self._ids.setdefault(name, str(playlist['id']))
+            return self._ids[name]
+
+    def find_or_create(self, sp_client, name, public=True):
+        return self.find(sp_client, name) or self.create(sp_client, name, public=public)
+
+
+_playlist_indexes = {}
+_playlist_indexes_lock = threading.Lock()
+
+
+def playlist_index(username):
+    """
+    the process wide PlaylistIndex for username.
+    """
+    with _playlist_indexes_lock:
+        if username not in _playlist_indexes:
+            _playlist_indexes[username] = PlaylistIndex(username)
+        return _playlist_indexes[username]
@@ -0,0 +1,139 @@
+"""
+Brings an existing playlist in line with a list of tracks, touching only what differs.
+
+sync_playlist() reads what's in the playlist now, removes the tracks that shouldn't be there (and any that are in it
+more than once), moves any that are out of order and adds the missing ones at their positions, so rerunning a
+generator over a playlist it has already built makes no writes at all, and a song that only resolves on a later run
+still lands in its chart position rather than at the end. Tracks are kept once each, in the order they were first
+wanted.
+
+PlaylistJournal records, per playlist name, the playlist's id, a hash of the rows it was built from and the
+snapshot_id Spotify gave it afterwards. If the rows haven't changed and neither has the playlist (same snapshot_id),
+the generator can skip it without resolving a single track. Each entry is written as soon as its playlist is done,
+so an interrupted run picks up where it stopped. The rows should say how each song resolved (its track uri, or None),
+so that a song found later makes them different; an entry built with songs missing can also be given a retry_after,
+past which it no longer counts as current and the missing songs are searched for again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+MAX_TRACKS_PER_REQUEST = 100  # Spotify's limit for adding or removing tracks in one call
+DEFAULT_JOURNAL_PATH = os.environ.get('PLAYLIST_JOURNAL_PATH',
+                                      os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   'playlist_journal.json'))
+
+
+def rows_hash(rows):
+    return hashlib.sha256(json.dumps(rows, default=str).encode('utf-8')).hexdigest()
+
+
+def playlist_snapshot_id(sp_client, playlist_id):
+    return sp_client.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+
+
+def playlist_track_ids(sp_client, playlist_id):
+    """
+    ids of the tracks in the playlist, in order. local files and unavailable tracks (no id) are left out.
+    """
+    track_ids = []
+    page = sp_client.playlist_items(playlist_id, fields='items(track(id)),next', limit=MAX_TRACKS_PER_REQUEST)
+    while page:
+        track_ids.extend(item['track']['id'] for item in page['items'] if item['track'] and item['track']['id'])
+        page = sp_client.next(page) if page['next'] else None
+    return track_ids
+
+
+def diff_tracks(current, desired):
+    """
+    (to_remove, to_add): the tracks in current that aren't wanted or are there more than once, and the wanted tracks
+    that current won't have once they're gone.
+    """
+    counts, desired_set = Counter(current), set(desired)
+    to_remove = [track_id for track_id in counts if track_id not in desired_set or counts[track_id] > 1]
+    kept = set(counts) - set(to_remove)
+    to_add = [track_id for track_id in dict.fromkeys(desired) if track_id not in kept]
+    return to_remove, to_add
+
+
+def reorder_moves(current, desired):
+    """
+    (range_start, insert_before) moves, applied in turn, that put current (no repeats, every track in desired) into
+    desired's order.
+    """
+    current = list(current)
+    moves = []
+    for i, track_id in enumerate(track_id for track_id in desired if track_id in set(current)):
+        j = current.index(track_id, i)
+        if j != i:
+            moves.append((j, i))
+            current.insert(i, current.pop(j))
+    return moves
+
+
+def sync_playlist(sp_client, username, playlist_id, track_ids):
+    """
+    makes the playlist hold track_ids, with as few writes as possible. returns the playlist's snapshot_id afterwards.
+    """
+    current = playlist_track_ids(sp_client, playlist_id)
+    desired = list(dict.fromkeys(track_ids))
+    to_remove, to_add = diff_tracks(current, desired)
+    for start in range(0, len(to_remove), MAX_TRACKS_PER_REQUEST):
+        sp_client.user_playlist_remove_all_occurrences_of_tracks(username,
+                                                                 playlist_id,
+                                                                 to_remove[start:start + MAX_TRACKS_PER_REQUEST])
+
+    removed = set(to_remove)
+    for range_start, insert_before in reorder_moves([t for t in current if t not in removed], desired):
+        sp_client.playlist_reorder_items(playlist_id, range_start=range_start, insert_before=insert_before)
+
+    # with the kept tracks in order, each missing one goes in at its index in desired; runs of them go in together
+    missing = set(to_add)
+    position = 0
+    while position < len(desired):
+        if desired[position] not in missing:
+            position += 1
+            continue
+        run = [desired[position]]
+        while (position + len(run) < len(desired) and desired[position + len(run)] in missing and
+               len(run) < MAX_TRACKS_PER_REQUEST):
+            run.append(desired[position + len(run)])
+        sp_client.user_playlist_add_tracks(username, playlist_id, tracks=run, position=position)
+        position += len(run)
+    return playlist_snapshot_id(sp_client, playlist_id)
+
+
+class PlaylistJournal(object):
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def is_current(self, sp_client, playlist_name, playlist_id, rows):
+        """
+        True if the playlist was last built from these rows, hasn't been changed since and isn't due a retry.
+        """
+        entry = self.entries.get(playlist_name)
+        if not entry or entry['playlist_id'] != playlist_id or entry['rows_hash'] != rows_hash(rows):
+            return False
+        if entry.get('retry_at') and time.time() >= entry['retry_at']:
+            return False
+        return playlist_snapshot_id(sp_client, playlist_id) == entry['snapshot_id']
+
+    def record(self, playlist_name, playlist_id, rows, snapshot_id, retry_after=None):
+        with self._lock:
+            self.entries[playlist_name] = dict(playlist_id=playlist_id,
+                                               rows_hash=rows_hash(rows),
+                                               snapshot_id=snapshot_id,
+                                               retry_at=time.time() + retry_after if retry_after else None)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)  # never leave a half written journal behind
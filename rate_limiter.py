@@ -0,0 +1,95 @@
+"""
+Token bucket for pacing calls to rate limited APIs (mainly the Spotify Web API).
+
+One limiter is meant to be shared by every thread talking to the same API. It starts at `rate` calls per second,
+creeps back up towards `max_rate` while calls succeed, and on an HTTP 429 cuts the rate and holds every caller until
+the Retry-After period has passed. The rate is cut once per episode: the other calls that were in flight when the
+first 429 came back usually get one too, and those only extend the hold.
+"""
+import threading
+import time
+
+import metrics
+
+TOO_MANY_REQUESTS = 429
+
+
+class AdaptiveRateLimiter(object):
+    def __init__(self, rate=5.0, min_rate=0.5, max_rate=20.0, burst=5, increase=0.5, decrease=0.5,
+                 max_retries=5, default_retry_after=1.0, name='api'):
+        self.name = name  # the service, for metrics
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.burst = float(burst)
+        self.increase = increase  # calls/sec gained per second of successful calls
+        self.decrease = decrease  # multiplier applied to the rate on a 429
+        self.max_retries = max_retries
+        self.default_retry_after = default_retry_after
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """
+        blocks until the caller is allowed to make one call.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self, retry_after=None):
+        if retry_after is None:
+            retry_after = self.default_retry_after
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._blocked_until:  # not already holding for an earlier 429 of the same episode
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = 0.0
+            self._last_refill = now
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    def retry_after(self, error):
+        headers = getattr(error, 'headers', None) or {}
+        try:
+            return float(headers.get('Retry-After', self.default_retry_after))
+        except (TypeError, ValueError):
+            return self.default_retry_after
+
+    def call(self, func, *args, **kwargs):
+        """
+        calls func(*args, **kwargs) once a token is available, backing off and retrying when it is rate limited.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if getattr(e, 'http_status', None) != TOO_MANY_REQUESTS or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                metrics.inc('api_retries_total', service=self.name)
+                self.on_throttle(self.retry_after(e))
+            else:
+                self.on_success()
+                return result
@@ -0,0 +1,465 @@
+"""
+Data access for the songbase Postgres database.
+
+Everything that reads or writes songbase goes through this module so that a process keeps a small pool of open
+connections instead of paying for a new connection (TCP + auth) on every query. The queries run on every page view
+or every year of a batch run are PREPAREd once per pooled connection and then just EXECUTEd.
+
+Writes that don't need to happen inside a request (resolved Spotify info, songs not on Spotify) are buffered by a BufferedWriter and
+flushed in bulk from a background thread, and the song_peaks_mv refresh they make necessary is debounced so it runs
+at most once per MV_REFRESH_DELAY however many songs were written.
+
+Connection settings come from the DB_NAME, DB_USER, DB_HOST, DB_PORT and (optional) DB_PASSWORD environment
+variables; DB_POOL_SIZE caps the number of open connections.
+"""
+import atexit
+import csv
+import io
+import os
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+import metrics
+
+MV_REFRESH_DELAY = 60
+
+STATEMENTS = {
+    'songs_for_year': """
+        SELECT artist, song, spotify_track_uri, spotify_song, spotify_artist, spotify_track_duration
+        FROM songbase.song_peaks_mv
+        WHERE chart_peak BETWEEN $1 AND $2
+          AND week_start_date >= make_date($3, 1, 1)
+          AND week_start_date < make_date($3 + 1, 1, 1)
+        ORDER BY week_start_date, chart_peak, artist, song""",
+    'random_song': """
+        SELECT
+            song, artist, chart_peak, EXTRACT(YEAR FROM week_start_date)::INT,
+            spotify_track_uri, spotify_song, spotify_artist, spotify_track_duration
+        FROM songbase.song_peaks_mv
+        WHERE chart_peak BETWEEN $1 AND $2
+          AND EXTRACT(YEAR FROM week_start_date) BETWEEN $3 AND $4
+        ORDER BY RANDOM() LIMIT 1""",
+}
+
+
+class SongbaseConnection(psycopg2.extensions.connection):
+    """
+    a connection that remembers which of STATEMENTS it has already prepared.
+    """
+    def __init__(self, *args, **kwargs):
+        super(SongbaseConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class ConnectionPool(object):
+    """
+    ThreadedConnectionPool raises when it runs out of connections; this waits for one to be handed back instead.
+    """
+    def __init__(self, max_connections, **connect_kwargs):
+        self._available = threading.BoundedSemaphore(max_connections)
+        self._pool = ThreadedConnectionPool(1, max_connections, connection_factory=SongbaseConnection, **connect_kwargs)
+
+    def getconn(self):
+        self._available.acquire()
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._available.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connect_kwargs():
+    kwargs = dict(dbname=os.environ['DB_NAME'],
+                  user=os.environ['DB_USER'],
+                  host=os.environ['DB_HOST'],
+                  port=os.environ.get('DB_PORT', '5432'))
+    if os.environ.get('DB_PASSWORD'):
+        kwargs['password'] = os.environ['DB_PASSWORD']
+    return kwargs
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(int(os.environ.get('DB_POOL_SIZE', 10)), **connect_kwargs())
+        return _pool
+
+
+@contextmanager
+def connection():
+    """
+    borrows a pooled connection, committing on success and rolling back if the block raises.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def execute(cur, name, params):
+    """
+    runs one of STATEMENTS on cur, preparing it on this connection the first time it's used.
+    """
+    conn = cur.connection
+    if name not in conn.prepared:
+        cur.execute('PREPARE {0} AS {1}'.format(name, STATEMENTS[name]))
+        conn.prepared.add(name)
+    cur.execute('EXECUTE {0} ({1})'.format(name, ', '.join(['%s'] * len(params))), params)
+
+
+@metrics.instrument('songbase')
+def query(sql, params=None):
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+
+@metrics.instrument('songbase')
+def fetch_songs(chart_min, chart_max, year):
+    """
+    (artist, song, spotify_info) for every song from year that peaked between chart_min and chart_max, spotify_info
+    being as for stream_songs_by_year.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        execute(cur, 'songs_for_year', (chart_min, chart_max, year))
+        return [(row[0], row[1], spotify_info(row[2:])) for row in cur.fetchall()]
+
+
+def stream_songs_by_year(chart_min, chart_max, year_start, year_end, itersize=2000):
+    """
+    yields (year, [(artist, song, spotify_info), ...]) for each year from year_start to year_end that has any songs
+    peaking between chart_min and chart_max. spotify_info is the song's track_info if it has been resolved already,
+    else None. all the years come from a single query read through a server-side cursor, so only about one year's rows
+    are held in memory at a time.
+    """
+    with connection() as conn:
+        with conn.cursor(name='songs_by_year') as cur:
+            cur.itersize = itersize
+            with metrics.timed('songbase', 'stream_songs_by_year'):  # just the DECLARE; fetches go to the reader
+                cur.execute("""
+                    SELECT
+                        EXTRACT(YEAR FROM week_start_date)::INT, artist, song,
+                        spotify_track_uri, spotify_song, spotify_artist, spotify_track_duration
+                    FROM songbase.song_peaks_mv
+                    WHERE chart_peak BETWEEN %s AND %s
+                      AND week_start_date >= make_date(%s, 1, 1)
+                      AND week_start_date < make_date(%s + 1, 1, 1)
+                    ORDER BY week_start_date, chart_peak, artist, song""", (chart_min, chart_max, year_start, year_end))
+            for year, rows in groupby(cur, key=itemgetter(0)):
+                yield year, [(row[1], row[2], spotify_info(row[3:])) for row in rows]
+
+
+def spotify_info(columns):
+    """
+    the track_info for (spotify_track_uri, spotify_song, spotify_artist, spotify_track_duration), or None if the song
+    hasn't been resolved.
+    """
+    track_uri, song, artist, track_duration = columns
+    if not track_uri:
+        return None
+    return dict(track_uri=track_uri, song=song, artist=artist, track_duration=track_duration)
+
+
+@metrics.instrument('songbase')
+def fetch_random_song(max_pos, min_pos, year_start, year_end):
+    with connection() as conn, conn.cursor() as cur:
+        execute(cur, 'random_song', (max_pos, min_pos, year_start, year_end))
+        return cur.fetchone()
+
+
+@metrics.instrument('songbase')
+def update_spotify_info_many(rows):
+    """
+    writes resolved Spotify info back to weekly_charts. rows are (song, artist, spotify_info) and only chart rows
+    whose Spotify columns are missing or different are touched. returns the number of chart rows updated.
+    """
+    values = dict(((song, artist), (song,
+                                    artist,
+                                    spotify_info['track_uri'],
+                                    spotify_info['song'],
+                                    spotify_info['artist'],
+                                    spotify_info['track_duration'])) for song, artist, spotify_info in rows)
+    with connection() as conn, conn.cursor() as cur:
+        execute_values(cur, """
+            UPDATE songbase.weekly_charts AS wc
+            SET spotify_track_uri = v.track_uri,
+                spotify_song = v.spotify_song,
+                spotify_artist = v.spotify_artist,
+                spotify_track_duration = v.track_duration
+            FROM (VALUES %s) AS v (song, artist, track_uri, spotify_song, spotify_artist, track_duration)
+            WHERE wc.song = v.song
+              AND wc.artist = v.artist
+              AND (wc.spotify_track_uri IS DISTINCT FROM v.track_uri
+                OR wc.spotify_song IS DISTINCT FROM v.spotify_song
+                OR wc.spotify_artist IS DISTINCT FROM v.spotify_artist
+                OR wc.spotify_track_duration IS DISTINCT FROM v.track_duration)""",
+                       list(values.values()),
+                       template='(%s, %s, %s, %s, %s, %s::INT)',
+                       page_size=len(values))
+        return cur.rowcount
+
+
+@metrics.instrument('songbase')
+def refresh_song_peaks(concurrently=True):
+    """
+    CONCURRENTLY needs a unique index on song_peaks_mv (see sql/); without one this falls back to a plain refresh,
+    which blocks readers while it runs.
+    """
+    try:
+        with connection() as conn, conn.cursor() as cur:
+            cur.execute('REFRESH MATERIALIZED VIEW {0} songbase.song_peaks_mv;'.format(
+                'CONCURRENTLY' if concurrently else ''))
+    except psycopg2.errors.ObjectNotInPrerequisiteState:
+        print('song_peaks_mv has no unique index, so it can\'t be refreshed concurrently')
+        refresh_song_peaks(concurrently=False)
+
+
+class DebouncedRefresh(object):
+    """
+    calls refresh() once, delay seconds after the first request() since the last refresh.
+    """
+    def __init__(self, refresh, delay=MV_REFRESH_DELAY):
+        self.refresh = refresh
+        self.delay = delay
+        self._timer = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def request(self):
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.refresh()
+        except Exception as e:
+            print('Could not refresh song_peaks_mv because: {0}'.format(e))
+
+    def flush(self):
+        """
+        runs a pending refresh now rather than waiting for the timer.
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            self.refresh()
+
+
+class BufferedWriter(object):
+    """
+    collects rows and hands them to write(rows) in bulk from a background thread, every interval seconds or as soon
+    as max_batch rows are waiting. rows still buffered when the process exits are written then.
+
+    if a write fails the rows are kept for the next one, which is left until the next interval however many rows
+    build up meanwhile. at most max_backlog rows are kept, the newest; older ones are dropped (and counted) rather
+    than let a database outage grow the buffer without limit. everything the writers buffer is worked out again on
+    the next run, so dropped rows cost time, not data.
+    """
+    def __init__(self, write, interval=5.0, max_batch=500, max_backlog=20000, on_written=None,
+                 name='songbase-writer'):
+        self.write = write
+        self.name = name
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_backlog = max_backlog
+        self.on_written = on_written
+
+        self.dropped = 0
+        self._failing = False
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def add(self, row):
+        with self._lock:
+            self._rows.append(row)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            if len(self._rows) >= self.max_batch and not self._failing:
+                self._wake.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                written = self.write(rows)
+            except Exception as e:
+                with self._lock:
+                    self._failing = True
+                    self._rows = rows + self._rows  # try again next time
+                    n_dropped = max(0, len(self._rows) - self.max_backlog)
+                    if n_dropped:
+                        del self._rows[:n_dropped]
+                        self.dropped += n_dropped
+                print('Could not write {0} buffered rows because: {1}{2}'.format(
+                    len(rows), e, '; dropped the oldest {0:,}'.format(n_dropped) if n_dropped else ''))
+                return
+            with self._lock:
+                self._failing = False
+            if self.on_written:
+                self.on_written(written)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+@metrics.instrument('songbase')
+def log_not_on_spotify_many(rows):
+    """
+    records (song, artist) rows in songs_not_on_spotify, skipping ones already there (see sql/ for the unique index
+    this relies on). returns the number of rows inserted.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO songbase.songs_not_on_spotify (song, artist)
+            VALUES %s
+            ON CONFLICT DO NOTHING""", sorted(set(rows)), page_size=len(rows))
+        return cur.rowcount
+
+
+@metrics.instrument('songbase')
+def fetch_unresolved_songs(after=None, limit=1000, skip_known_misses=True):
+    """
+    up to limit distinct (song, artist) pairs from song_peaks_mv that have no Spotify track yet, in (song, artist)
+    order, starting after the pair after. songs already in songs_not_on_spotify are left out unless
+    skip_known_misses is False.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT song, artist
+            FROM songbase.song_peaks_mv AS mv
+            WHERE spotify_track_uri IS NULL
+              AND (%(song)s IS NULL OR (song, artist) > (%(song)s, %(artist)s))
+              AND NOT (%(skip_known_misses)s AND EXISTS (
+                  SELECT 1 FROM songbase.songs_not_on_spotify AS m WHERE m.song = mv.song AND m.artist = mv.artist))
+            ORDER BY song, artist
+            LIMIT %(limit)s""", dict(song=after[0] if after else None,
+                                    artist=after[1] if after else None,
+                                    skip_known_misses=skip_known_misses,
+                                    limit=limit))
+        return cur.fetchall()
+
+
+@metrics.instrument('songbase')
+def get_watermark(job):
+    """
+    the last (song, artist) the backfill job finished, or None (see sql/ for the table).
+    """
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute('SELECT song, artist FROM songbase.backfill_watermarks WHERE job = %s', (job,))
+        return cur.fetchone()
+
+
+@metrics.instrument('songbase')
+def clear_watermark(job):
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute('DELETE FROM songbase.backfill_watermarks WHERE job = %s', (job,))
+
+
+@metrics.instrument('songbase')
+def backfill_spotify_info(hits, misses, job, watermark):
+    """
+    writes one backfill batch in a single transaction: hits, (song, artist, spotify_info) rows, are COPYed into a
+    staging table and applied to weekly_charts with one UPDATE; misses go into songs_not_on_spotify; and the job's
+    watermark moves to watermark. returns the number of chart rows updated.
+    """
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for song, artist, info in hits:
+        writer.writerow([song, artist, info['track_uri'], info['song'], info['artist'], info['track_duration']])
+    data.seek(0)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE spotify_info_staging (
+                song TEXT, artist TEXT, track_uri TEXT, spotify_song TEXT, spotify_artist TEXT, track_duration INT
+            ) ON COMMIT DROP""")
+        cur.copy_expert('COPY spotify_info_staging FROM STDIN WITH (FORMAT csv)', data)
+        cur.execute("""
+            UPDATE songbase.weekly_charts AS wc
+            SET spotify_track_uri = s.track_uri,
+                spotify_song = s.spotify_song,
+                spotify_artist = s.spotify_artist,
+                spotify_track_duration = s.track_duration
+            FROM spotify_info_staging AS s
+            WHERE wc.song = s.song
+              AND wc.artist = s.artist
+              AND (wc.spotify_track_uri IS DISTINCT FROM s.track_uri
+                OR wc.spotify_song IS DISTINCT FROM s.spotify_song
+                OR wc.spotify_artist IS DISTINCT FROM s.spotify_artist
+                OR wc.spotify_track_duration IS DISTINCT FROM s.track_duration)""")
+        n_updated = cur.rowcount
+        if misses:
+            execute_values(cur, """
+                INSERT INTO songbase.songs_not_on_spotify (song, artist)
+                VALUES %s
+                ON CONFLICT DO NOTHING""", sorted(set(misses)), page_size=len(misses))
+        cur.execute("""
+            INSERT INTO songbase.backfill_watermarks (job, song, artist, updated_at)
+            VALUES (%s, %s, %s, now())
+            ON CONFLICT (job) DO UPDATE
+            SET song = excluded.song, artist = excluded.artist, updated_at = excluded.updated_at""",
+                    (job,) + tuple(watermark))
+        return n_updated
+
+
+def _refresh_if_updated(n_updated):
+    if n_updated:
+        song_peaks_refresher.request()
+
+
+song_peaks_refresher = DebouncedRefresh(refresh_song_peaks)
+spotify_info_writer = BufferedWriter(update_spotify_info_many, on_written=_refresh_if_updated,
+                                     name='songbase-spotify-writer')
+not_on_spotify_writer = BufferedWriter(log_not_on_spotify_many, name='songbase-miss-writer')
+
+
+def log_not_on_spotify(song, artist):
+    """
+    buffered; the insert happens in the background with other misses.
+    """
+    not_on_spotify_writer.add((song, artist))
@@ -0,0 +1,8 @@
+-- backfill.py records how far it has got here, in the same transaction as each batch it writes back, so a stopped
+-- backfill carries on from its last finished batch.
+CREATE TABLE IF NOT EXISTS songbase.backfill_watermarks (
+    job TEXT PRIMARY KEY,
+    song TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
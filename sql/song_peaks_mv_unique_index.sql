@@ -0,0 +1,3 @@
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY (songbase.refresh_song_peaks) needs a unique index on the view.
+CREATE UNIQUE INDEX IF NOT EXISTS song_peaks_mv_song_artist_week
+    ON songbase.song_peaks_mv (song, artist, week_start_date);
@@ -0,0 +1,9 @@
+-- songbase.log_not_on_spotify_many inserts with ON CONFLICT DO NOTHING and relies on this to skip known misses.
+DELETE FROM songbase.songs_not_on_spotify a
+    USING songbase.songs_not_on_spotify b
+    WHERE a.ctid > b.ctid
+      AND a.song = b.song
+      AND a.artist = b.artist;
+
+CREATE UNIQUE INDEX IF NOT EXISTS songs_not_on_spotify_song_artist
+    ON songbase.songs_not_on_spotify (song, artist);
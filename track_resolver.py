@@ -0,0 +1,223 @@
+"""
+Finds the Spotify track for a chart (song, artist).
+
+Each search asks for a handful of candidates and scores them locally against both the raw chart names and their
+cleaned forms, so near misses (apostrophes, americanisms, remaster suffixes, "the") are matched without another
+round-trip. Only when nothing clears MATCH_THRESHOLD does the resolver try the next, looser query in a short ladder.
+A matching title isn't enough on its own: the artist has to clear a minimum of its own too, higher on the looser
+rungs, which are the ones that turn up covers and unrelated songs of the same name.
+
+Searches run on a small thread pool, and every request a SpotifyClient makes (searches and all the rest) goes through
+one shared AdaptiveRateLimiter, so throughput is set by what Spotify will actually allow rather than by a fixed sleep
+between calls. Given a TrackCache, hits and known
+misses are answered without calling Spotify at all, and lookups of a song that's already being looked up (the same
+cleaned song and artist, from another thread or another resolver) wait for that lookup rather than searching again.
+
+stages() gives the cleaning and searching steps as pipeline Stages, so callers can stream chart rows through them
+(with their own stages on the end) rather than resolving a whole list at once.
+"""
+import re
+import threading
+from difflib import SequenceMatcher
+
+import spotipy
+
+import metrics
+from caching import NOT_CACHED, SingleFlight
+from cleaning import clean_song, clean_artist
+from pipeline import Pipeline, Stage
+from rate_limiter import AdaptiveRateLimiter
+
+# leave 429s to the rate limiter instead of spotipy's own fixed retry/backoff
+SPOTIFY_STATUS_FORCELIST = (500, 502, 503, 504)
+
+
+class SpotifyClient(spotipy.Spotify):
+    """
+    spotipy.Spotify with every request paced by rate_limiter (spotify_rate_limiter unless told otherwise), which also
+    retries the ones that get a 429. urllib3 is kept from retrying 429s itself: keeping 429 out of status_forcelist
+    isn't enough on its own, as it still sleeps out and retries any 429 that has a Retry-After header, which
+    Spotify's always do.
+    """
+    def __init__(self, *args, rate_limiter=None, **kwargs):
+        kwargs.setdefault('status_forcelist', SPOTIFY_STATUS_FORCELIST)
+        super(SpotifyClient, self).__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter or spotify_rate_limiter
+
+    def _build_session(self):
+        super(SpotifyClient, self)._build_session()
+        adapter = self._session.get_adapter(self.prefix)  # the same adapter is mounted for http:// and https://
+        adapter.max_retries = adapter.max_retries.new(respect_retry_after_header=False)
+
+    def _internal_call(self, method, url, payload, params):
+        return self.rate_limiter.call(super(SpotifyClient, self)._internal_call, method, url, payload, params)
+
+
+# one bucket per process, shared by every client talking to Spotify
+spotify_rate_limiter = AdaptiveRateLimiter(name='spotify')
+# likewise one per process, so a song being looked up is only searched for once however many callers want it
+spotify_lookups = SingleFlight()
+
+# what stages() gives for a song whose search failed (as opposed to None, for one Spotify doesn't have)
+SEARCH_FAILED = object()
+
+N_CANDIDATES = 5
+MATCH_THRESHOLD = 0.75
+SONG_WEIGHT = 0.6  # the artist gets the rest
+
+# from strictest to loosest, each with the least artist_score a candidate it finds must have; queries are formatted
+# with the cleaned song and artist. a different singer of the same song is the usual false match, and they mostly
+# come from the free text and track only searches, so those need the artist to match nearly outright
+QUERY_LADDER = (('artist:{artist} AND track:{song}', 0.7),
+                ('{song} {artist}', 0.85),
+                ('track:{song}', 0.85))
+
+NON_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+VERSION_SUFFIX = re.compile(r' - .*$')  # e.g. "Hey Jude - Remastered 2015"
+
+
+def track_info(item):
+    """
+    the bits of a Spotify track object the rest of the project cares about.
+    """
+    return dict(track_uri=item['id'],
+                song=item['name'],
+                artist=', '.join([i['name'] for i in item['artists']]),
+                track_duration=item['duration_ms'])
+
+
+def normalise(text):
+    return NON_ALPHANUMERIC.sub(' ', text.lower().replace('\'', '')).strip()
+
+
+def similarity(a, b):
+    return SequenceMatcher(None, normalise(a), normalise(b)).ratio()
+
+
+def artist_score(item, artist, cleaned_artist):
+    """
+    how well a search result's artists match the chart artist, from 0 to 1.
+    """
+    artist_names = [i['name'] for i in item['artists']]
+    return max([similarity(', '.join(artist_names), artist)] +
+               [max(similarity(a, artist), similarity(clean_artist(a), cleaned_artist)) for a in artist_names])
+
+
+def score(item, song, artist, cleaned_song, cleaned_artist):
+    """
+    how well a search result matches the chart entry, from 0 to 1.
+    """
+    name = VERSION_SUFFIX.sub('', item['name'])
+    song_score = max(similarity(name, song), similarity(clean_song(name), cleaned_song))
+    return SONG_WEIGHT * song_score + (1 - SONG_WEIGHT) * artist_score(item, artist, cleaned_artist)
+
+
+
+class TrackResolver(object):
+    def __init__(self, sp_client, rate_limiter=None, max_workers=4, cache=None, n_candidates=N_CANDIDATES,
+                 threshold=MATCH_THRESHOLD, query_ladder=QUERY_LADDER, single_flight=None):
+        self.sp_client = sp_client
+        self.rate_limiter = rate_limiter  # only needed for a client that doesn't pace itself as SpotifyClient does
+        self.max_workers = max_workers
+        self.cache = cache
+        self.n_candidates = n_candidates
+        self.threshold = threshold
+        self.query_ladder = query_ladder
+        self.single_flight = single_flight or spotify_lookups
+
+        self.search_calls = 0
+        self.searches_saved = 0  # searches other callers' lookups made for us
+        self._lock = threading.Lock()
+
+    def resolve(self, song, artist):
+        """
+        returns the track_info of the best match for a chart song and artist, or None if there isn't one.
+        """
+        return self.resolve_cleaned(song, artist, clean_song(song), clean_artist(artist))
+
+    def resolve_cleaned(self, song, artist, cleaned_song, cleaned_artist):
+        (info, n_searches), shared = self.single_flight.do((cleaned_song, cleaned_artist), self._lookup,
+                                                           song, artist, cleaned_song, cleaned_artist)
+        if shared and n_searches:
+            metrics.inc('api_calls_saved_total', n_searches, service='spotify')
+            with self._lock:
+                self.searches_saved += n_searches
+        return info
+
+    def _lookup(self, song, artist, cleaned_song, cleaned_artist):
+        """
+        (track_info or None, the number of searches it took).
+        """
+        if self.cache is not None:
+            info = self.cache.get(cleaned_song, cleaned_artist)
+            metrics.cache_lookup('tracks', info is not NOT_CACHED)
+            if info is not NOT_CACHED:
+                return info, 0
+        info, n_searches = self._search(song, artist, cleaned_song, cleaned_artist)
+        if self.cache is not None:
+            self.cache.set(cleaned_song, cleaned_artist, info)
+        return info, n_searches
+
+    def search(self, song, artist, cleaned_song, cleaned_artist):
+        return self._search(song, artist, cleaned_song, cleaned_artist)[0]
+
+    def _search(self, song, artist, cleaned_song, cleaned_artist):
+        for n_searches, (query, min_artist_score) in enumerate(self.query_ladder, 1):
+            with self._lock:
+                self.search_calls += 1
+            search = dict(q=query.format(song=cleaned_song, artist=cleaned_artist),
+                          limit=self.n_candidates,
+                          type='track')
+            if self.rate_limiter is None:
+                results = self.sp_client.search(**search)
+            else:
+                results = self.rate_limiter.call(self.sp_client.search, **search)
+            scored = [(score(item, song, artist, cleaned_song, cleaned_artist), item)
+                      for item in results['tracks']['items']
+                      if item and item['id'] and artist_score(item, artist, cleaned_artist) >= min_artist_score]
+            if scored:
+                best_score, best = max(scored, key=lambda x: x[0])  # max keeps Spotify's order on ties
+                if best_score >= self.threshold:
+                    return track_info(best), n_searches
+        return None, len(self.query_ladder)
+
+    @staticmethod
+    def _clean(item):
+        song, artist = item[:2]
+        return (song, artist, clean_song(song), clean_artist(artist)) + tuple(item[2:3])
+
+    def _resolve(self, args):
+        if len(args) > 4 and args[4]:  # already resolved
+            return args[:2], args[4]
+        return args[:2], self.resolve_cleaned(*args[:4])
+
+    def _resolve_or_failed(self, args):
+        try:
+            return self._resolve(args)
+        except Exception as e:
+            print('Search for {0} by {1} failed because: {2}'.format(args[0], args[1], e))
+            return args[:2], SEARCH_FAILED
+
+    def stages(self, strict=False):
+        """
+        pipeline stages taking chart (song, artist) pairs to ((song, artist), track_info or None). an item can also be
+        (song, artist, known_info), in which case a known_info that isn't None is passed through without a search.
+        a failed search gives SEARCH_FAILED rather than None, so it isn't mistaken for a song Spotify doesn't have,
+        unless strict, when it's raised to whoever is reading the pipeline.
+        """
+        return [Stage(self._clean, name='clean'),
+                Stage(self._resolve if strict else self._resolve_or_failed, workers=self.max_workers, name='resolve')]
+
+    def stream(self, pairs, strict=False):
+        """
+        resolves chart (song, artist) pairs concurrently, yielding ((song, artist), track_info, None or SEARCH_FAILED)
+        in order. pairs can be any iterable, and is only read as fast as Spotify can keep up.
+        """
+        return Pipeline(*self.stages(strict=strict)).run(pairs)
+
+    def resolve_many(self, pairs):
+        """
+        resolves chart (song, artist) pairs concurrently. results come back in the same order as pairs, None for misses
+        and failed searches.
+        """
+        return [None if info is SEARCH_FAILED else info for _, info in self.stream(pairs)]
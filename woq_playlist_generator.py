@@ -3,52 +3,87 @@ Logic for creating a WoQ style quiz
 """
 from __future__ import division
 from PlaylistGenerator import PlaylistGenerator
+import argparse
 import math
-import random
-import psycopg2
-import os
+import numpy as np
+import metrics
+import songbase
 from scraping.utils import load_env_from_env_file
 
-load_env_from_env_file()
+QUIZ_INDEX_QUERY = """
+SELECT
+    EXTRACT(YEAR FROM week_start_date)::INT, chart_peak, artist, song, week_start_date,
+    spotify_track_uri, spotify_song, spotify_artist, spotify_track_duration
+FROM songbase.song_peaks_mv
+WHERE chart_peak BETWEEN 1 AND %s
+  AND week_start_date >= make_date(%s, 1, 1)
+  AND week_start_date < make_date(%s + 1, 1, 1)
+ORDER BY week_start_date, chart_peak, artist, song
+"""
 
 
 def find_poisson(lam, k):
-    print((math.e**(-lam))*(lam**(-k))) / (math.factorial(k))
-
-
-def db_query(query1):
-    conn = psycopg2.connect(dbname=os.environ['DB_NAME'],
-                            user=os.environ['DB_USER'],
-                            password=os.environ['DB_PASSWORD'],
-                            host=os.environ['DB_HOST'])
-    cur = conn.cursor()
-    cur.execute(query1)
-    result = cur.fetchall()
-    conn.commit()
-    cur.close()
-    conn.close()
-    return result
-
-
-
-class WoqCreator(PlaylistGenerator):
-    def __init__(self):
-        super(WoqCreator, self).__init__('WoQ March 2018', results)
-
-current_year = 2017
-results = []
-for year in range(1952, current_year):
-    while True:
-        chart_peak = round(random.randrange(0, 5), 0)
-        query = """
-        SELECT artist, song, week_start_date, chart_peak FROM songbase.song_peaks_mv WHERE chart_peak = {0} AND EXTRACT(YEAR FROM week_start_date) = {1} ORDER BY random() LIMIT 1;
-        """.format(chart_peak, year)
-        db_result = db_query(query)
-        if db_result is not None:
-            break
-        else:
-            db_result = []
-    results += db_result
-
-test = PlaylistGenerator('WoQ March 2018', results)
-test.generate_playlist()
+    return (lam ** k) * math.exp(-lam) / math.factorial(k)
+
+
+class WoqCreator(object):
+    """
+    picks one song per year for a quiz. every song from year_start to year_end that peaked at max_peak or higher is
+    loaded once; after that drawing a quiz (or a batch of them) doesn't touch the database.
+
+    a year's chart peaks are Poisson(lam) weighted on (peak - 1), so with lam=1 a number one is as likely as a number
+    two and twice as likely as a number three; a song is then picked uniformly from those at the chosen peak. peaks a
+    year doesn't have are never picked, and years with no songs at all are left out of the quiz.
+    """
+    def __init__(self, year_start=1952, year_end=2016, max_peak=4, lam=1.0, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+        index = songbase.query(QUIZ_INDEX_QUERY, (max_peak, year_start, year_end))
+        # artist, song, spotify_info (for PlaylistGenerator), week_start_date, chart_peak
+        self.rows = [(row[2], row[3], songbase.spotify_info(row[5:]), row[4], row[1]) for row in index]
+        years = np.array([row[0] for row in index], dtype=np.int32)
+        peaks = np.array([row[1] for row in index], dtype=np.int32)
+
+        self.years, self.year_starts = np.unique(years, return_index=True)
+        year_ids = np.repeat(np.arange(len(self.years)), np.diff(np.append(self.year_starts, len(years))))
+        self.year_ends = np.append(self.year_starts[1:], len(years)) - 1
+
+        peak_pmf = np.array([find_poisson(lam, k) for k in range(max_peak)])
+        _, year_peak, year_peak_counts = np.unique(year_ids * (max_peak + 1) + peaks,
+                                                   return_inverse=True, return_counts=True)
+        weights = peak_pmf[peaks - 1] / year_peak_counts[year_peak]
+        weights /= np.bincount(year_ids, weights=weights)[year_ids]
+        # each year's weights sum to 1, so year i covers (i, i + 1] of the running total
+        self.cumulative_weights = np.cumsum(weights)
+
+    def draw(self, n_quizzes=1):
+        """
+        an (n_quizzes, n_years) array of row ids, one song per year per quiz.
+        """
+        targets = self.rng.random((n_quizzes, len(self.years))) + np.arange(len(self.years))
+        row_ids = np.searchsorted(self.cumulative_weights, targets, side='right')
+        return np.clip(row_ids, self.year_starts, self.year_ends)  # guard against float error at year boundaries
+
+    def quizzes(self, n_quizzes):
+        return [[self.rows[i] for i in quiz] for quiz in self.draw(n_quizzes)]
+
+    def quiz(self):
+        return self.quizzes(1)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds a WoQ style quiz playlist, one song per year.')
+    metrics.add_profile_argument(parser)
+    args = parser.parse_args()
+    metrics.profile_stages(args.profile)
+
+    load_env_from_env_file()
+    woq = WoqCreator()
+    test = PlaylistGenerator('WoQ March 2018', woq.quiz())
+    test.generate_playlist()
+    songbase.not_on_spotify_writer.flush()
+    metrics.print_report(profile=args.profile)
+
+
+if __name__ == '__main__':
+    main()